@@ -1,16 +1,18 @@
-from flask import Flask, request, jsonify, make_response, render_template, session, send_from_directory, url_for
+from flask import Flask, Response, request, jsonify, make_response, render_template, session, send_from_directory, stream_with_context, url_for
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from pathlib import Path
 import sys
-from typing import Optional
+from typing import BinaryIO, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 import json
+import math
 import os
-import base64
-import re
-import sqlite3
+import threading
+import time
 from datetime import datetime
-from werkzeug.utils import secure_filename
 
 # Load environment variables from .env if present
 try:
@@ -20,11 +22,29 @@ except Exception:
     pass
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
+import assets
 import auth as auth_module
+import classification_cache
+import classifier
+import clusters
+import cosmetics
+import db
+import events
+import imaging
+import jobs
+import leaderboard
+import stats
+import storage
+import xp
 
 app = Flask(__name__, 
             static_folder='static',
             template_folder='templates')
+# Behind a reverse proxy, set this to the number of proxies in front of the app so
+# request.remote_addr (used by the login throttle) is the client, not the proxy
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '0'))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
 
 # Security configuration
 app.secret_key = auth_module.SECRET_KEY or 'dev-secret-key-change-in-production'
@@ -33,27 +53,71 @@ app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=1)
 app.config['SESSION_COOKIE_NAME'] = 'Invasisee_session'
-app.config['UPLOAD_FOLDER'] = str(Path(__file__).resolve().parent / 'uploads')
+app.config['UPLOAD_FOLDER'] = os.getenv('INVASISEE_UPLOAD_FOLDER') or str(Path(__file__).resolve().parent / 'uploads')
 Path(app.config['UPLOAD_FOLDER']).mkdir(parents=True, exist_ok=True)
+# Reject oversized request bodies before they are read
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', '20')) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_LEGACY_MAX_AGE = 3600  # Pre-content-addressing uploads keep their old, mutable names
 
-# XP system configuration
-XP_THRESHOLDS = [0, 50, 150, 300, 500]  # Levels 1..5
-MAX_LEVEL = 5
-XP_PER_INVASIVE = 50  # Award per correct (invasive) report
+# Batch submission configuration
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', '200'))
+BATCH_MAX_CONTENT_LENGTH = int(os.getenv('BATCH_MAX_UPLOAD_MB', '1024')) * 1024 * 1024
+BATCH_PARALLELISM = int(os.getenv('BATCH_PARALLELISM', '8'))  # Concurrent classifications across batches
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_PARALLELISM, thread_name_prefix="batch-classify")
+# Uploads waiting for an async classification job
+PENDING_FOLDER = Path(app.config['UPLOAD_FOLDER']) / 'pending'
+PENDING_FOLDER.mkdir(parents=True, exist_ok=True)
 
-# Cosmetics catalog (id, label, cost)
-COSMETICS_STORE = [
-    {"id": "pot_terracotta", "label": "Terracotta Pot", "cost": 50},
-    {"id": "pot_white", "label": "White Pot", "cost": 100},
-    {"id": "leaves_spring", "label": "Spring Leaves", "cost": 75},
-    {"id": "leaves_autumn", "label": "Autumn Leaves", "cost": 125},
-]
+# XP system configuration (the ledger lives in xp.py)
+XP_THRESHOLDS = xp.XP_THRESHOLDS
+MAX_LEVEL = xp.MAX_LEVEL
+XP_PER_INVASIVE = xp.XP_PER_INVASIVE
+
+# Map feed configuration
+REPORTS_MAX_LIMIT = 5000  # Upper bound for ?limit= on /api/reports
+MAX_REPORT_ID = 2**63 - 1  # Largest id SQLite can bind; bigger cursors overflow
+REPORTS_DEFAULT_LIMIT = int(os.getenv('REPORTS_DEFAULT_LIMIT', '1000'))  # Page size when ?limit= is omitted
+# ?fields= name -> column it is read from (None: derived without a column)
+REPORT_FIELDS = {
+    "id": "r.id",
+    "species": "r.species",
+    "invasive": None,  # The feed only carries invasive reports
+    "summary": "r.summary",
+    "lat": "r.lat",
+    "lng": "r.lng",
+    "image_url": "r.image_filename",
+    "image_urls": "r.image_filename",
+    "created_at": "r.created_at",
+    "username": "r.username",
+}
+
+# Live report stream (see events.py). Each open stream parks one worker thread,
+# so run gunicorn with threads (gthread) and keep the cap below its thread count
+STREAM_MAX_CONNECTIONS = int(os.getenv('STREAM_MAX_CONNECTIONS', '200'))
+STREAM_HEARTBEAT_SECONDS = 15  # Comment lines keep proxies from closing idle streams
+STREAM_MAX_SECONDS = 300  # Streams end periodically; EventSource reconnects with Last-Event-ID
+STREAM_RETRY_MS = 1000
+
+# Leaderboard configuration
+LEADERBOARD_DEFAULT_LIMIT = 10
+LEADERBOARD_MAX_LIMIT = 100
+
+# Session user cache (Flask-Login loads the user on every authenticated request)
+USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', '60'))
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', '10000'))
+
+# Cosmetics catalog (see cosmetics.py)
+COSMETICS_STORE = cosmetics.STORE
 
 # Flask-Login configuration
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.session_protection = 'strong'
 
+db.init_app(app)
+assets.init_app(app)
+
 
 class User(UserMixin):
     """User class for Flask-Login"""
@@ -63,99 +127,60 @@ class User(UserMixin):
         self.created_at = user_data['created_at']
 
 
+_user_cache: "OrderedDict[str, tuple]" = OrderedDict()  # user id -> (expires_at, User), LRU order
+_user_cache_lock = threading.Lock()
+
+
+def cache_user(user: User) -> None:
+    with _user_cache_lock:
+        _user_cache[user.id] = (time.monotonic() + USER_CACHE_TTL_SECONDS, user)
+        _user_cache.move_to_end(user.id)
+        while len(_user_cache) > USER_CACHE_MAX_ENTRIES:
+            _user_cache.popitem(last=False)
+
+
+def invalidate_user(user_id) -> None:
+    """Drop a cached user, e.g. on logout; other processes catch up within the TTL.
+
+    Only the User fields (id, username, created_at) are cached, so call this
+    when one of those changes. XP, level and cosmetics are read from the
+    database on every request, so changing them needs no invalidation.
+    """
+    with _user_cache_lock:
+        _user_cache.pop(str(user_id), None)
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    """Load user by ID for Flask-Login"""
-    # Query user by ID from database
-    import sqlite3
-    conn = sqlite3.connect(auth_module._db_path())
-    cur = conn.cursor()
-    cur.execute("SELECT id, username, password, created_at FROM users WHERE id = ?", (user_id,))
+    """Load user by ID for Flask-Login, from the in-process cache when fresh"""
+    user_id = str(user_id)
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                _user_cache.move_to_end(user_id)
+                return entry[1]
+            del _user_cache[user_id]
+
+    cur = db.get_db().cursor()
+    cur.execute("SELECT id, username, created_at FROM users WHERE id = ?", (user_id,))
     row = cur.fetchone()
-    conn.close()
-    
     if not row:
         return None
-    
-    user_data = {
-        "id": row[0],
-        "username": row[1],
-        "password": row[2],
-        "created_at": row[3]
-    }
-    return User(user_data)
-
-
-@app.before_request
-def init_db_once():
-    """Initialize database before first request"""
-    auth_module.init_db()
-    # Ensure reports table exists
-    conn = sqlite3.connect(auth_module._db_path())
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            username TEXT,
-            species TEXT,
-            invasive INTEGER,
-            summary TEXT,
-            lat REAL,
-            lng REAL,
-            image_filename TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
-    conn.commit()
-    # Ensure user XP columns exist
-    try:
-        cur.execute("PRAGMA table_info(users)")
-        cols = {row[1] for row in cur.fetchall()}
-        add_cols = []
-        if 'xp_total' not in cols:
-            add_cols.append("ALTER TABLE users ADD COLUMN xp_total INTEGER DEFAULT 0")
-        if 'xp_balance' not in cols:
-            add_cols.append("ALTER TABLE users ADD COLUMN xp_balance INTEGER DEFAULT 0")
-        if 'level' not in cols:
-            add_cols.append("ALTER TABLE users ADD COLUMN level INTEGER DEFAULT 1")
-        if 'unlocked_cosmetics' not in cols:
-            add_cols.append("ALTER TABLE users ADD COLUMN unlocked_cosmetics TEXT DEFAULT '[]'")
-        if 'active_cosmetic' not in cols:
-            add_cols.append("ALTER TABLE users ADD COLUMN active_cosmetic TEXT")
-        for stmt in add_cols:
-            try:
-                cur.execute(stmt)
-            except Exception:
-                pass
-        conn.commit()
-    finally:
-        conn.close()
-
-
-def compute_level(xp_total: int) -> int:
-    lvl = 1
-    for i, thr in enumerate(XP_THRESHOLDS, start=1):
-        if xp_total >= thr:
-            lvl = i
-    return min(lvl, MAX_LEVEL)
+    user = User({"id": row[0], "username": row[1], "created_at": row[2]})
+    cache_user(user)
+    return user
 
 
 def get_user_profile(user_id: str) -> dict:
-    conn = sqlite3.connect(auth_module._db_path())
+    conn = db.get_db()
     cur = conn.cursor()
-    cur.execute("SELECT username, xp_total, xp_balance, level, unlocked_cosmetics, active_cosmetic FROM users WHERE id = ?", (user_id,))
+    cur.execute("SELECT username, xp_total, xp_balance, level, active_cosmetic FROM users WHERE id = ?", (user_id,))
     row = cur.fetchone()
-    conn.close()
     if not row:
         return {}
-    username, xp_total, xp_balance, level, unlocked_json, active = row
-    try:
-        unlocked = json.loads(unlocked_json or '[]')
-    except Exception:
-        unlocked = []
+    username, xp_total, xp_balance, level, active = row
+    unlocked = cosmetics.owned(conn, user_id)
     next_level_idx = min(level, len(XP_THRESHOLDS)-1)
     next_threshold = XP_THRESHOLDS[next_level_idx]
     prev_threshold = XP_THRESHOLDS[max(0, next_level_idx-1)] if level > 1 else 0
@@ -173,19 +198,96 @@ def get_user_profile(user_id: str) -> dict:
     }
 
 
-def award_xp(user_id: str, amount: int) -> None:
+def award_xp(user_id: str, amount: int, reason: str = xp.REASON_REPORT) -> None:
+    """Record a standalone XP award in the ledger and update the user's totals."""
     if not user_id:
         return
-    conn = sqlite3.connect(auth_module._db_path())
-    cur = conn.cursor()
-    cur.execute("SELECT xp_total, xp_balance FROM users WHERE id = ?", (user_id,))
-    row = cur.fetchone()
-    xp_total = (row[0] if row else 0) + (amount or 0)
-    xp_balance = (row[1] if row else 0) + (amount or 0)
-    level = compute_level(xp_total)
-    cur.execute("UPDATE users SET xp_total = ?, xp_balance = ?, level = ? WHERE id = ?", (xp_total, xp_balance, level, user_id))
-    conn.commit()
-    conn.close()
+    with db.transaction() as cur:
+        xp.award(cur, user_id, amount, reason)
+
+
+# Held from BEGIN until the commit is published, so this process publishes in id order
+_save_order = threading.Lock()
+
+
+def save_reports(user_id, username, items: list) -> list:
+    """Persist invasive classifications and their XP awards in one transaction.
+
+    items is a list of (result, lat, lng, image, original_filename); returns a
+    (report_id, created) pair per item. A photo the same user already reported
+    (same stored content) is not saved or rewarded again; its pair carries the
+    earlier report's id and created=False.
+    """
+    if not items:
+        return []
+    rows = []
+    created_at = datetime.utcnow().isoformat()
+    for result, lat, lng, image, _ in items:
+        # Content-addressed, so a resubmitted photo reuses the stored file
+        fname = storage.store(image, app.config['UPLOAD_FOLDER'])
+        species = result.get('species') or 'Unknown'
+        rows.append((user_id, username, species, 1, result.get('summary') or '', lat, lng, fname, created_at))
+    with _save_order:
+        with db.transaction(immediate=True) as cur:
+            existing = {}
+            if user_id:
+                names = sorted({row[7] for row in rows})
+                cur.execute(
+                    f"""
+                    SELECT image_filename, MIN(id) FROM reports
+                    WHERE user_id = ? AND image_filename IN ({','.join('?' * len(names))})
+                    GROUP BY image_filename
+                    """,
+                    (user_id, *names),
+                )
+                existing = dict(cur.fetchall())
+            new_rows = []
+            for row in rows:
+                if row[7] not in existing:
+                    new_rows.append(row)
+                    if user_id:
+                        existing[row[7]] = None  # Repeated within this batch
+            report_ids = []
+            if new_rows:
+                cur.executemany(
+                    """
+                    INSERT INTO reports (user_id, username, species, invasive, summary, lat, lng, image_filename,
+                                         created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    new_rows
+                )
+                # AUTOINCREMENT ids are consecutive while we hold the write lock
+                cur.execute("SELECT last_insert_rowid()")
+                last_id = cur.fetchone()[0]
+                report_ids = list(range(last_id - len(new_rows) + 1, last_id + 1))
+                for row in new_rows:
+                    clusters.record_report(cur, row[5], row[6], row[2])
+                    stats.record(cur, row[5], row[6], row[2], created_at)
+                # Award XP for correct invasive reports
+                xp.award(cur, user_id, XP_PER_INVASIVE, xp.REASON_REPORT, report_ids)
+        # Only once committed, so a stream never announces a report a reader can't see yet
+        events.broker.publish([
+            {"id": report_id, "species": row[2], "lat": row[5], "lng": row[6], "image_filename": row[7]}
+            for report_id, row in zip(report_ids, new_rows)
+        ])
+    new_ids = iter(report_ids)
+    saved = []
+    for row in rows:
+        if user_id and existing.get(row[7]) is not None:
+            saved.append((existing[row[7]], False))
+        else:
+            report_id = next(new_ids)
+            saved.append((report_id, True))
+            if user_id:
+                existing[row[7]] = report_id
+    return saved
+
+
+def save_report(user_id, username, result: dict, lat: Optional[float], lng: Optional[float],
+                image: BinaryIO, original_filename: str) -> int:
+    """Persist an invasive classification with its image, update map cells and award XP."""
+    return save_reports(user_id, username, [(result, lat, lng, image, original_filename)])[0][0]
 
 
 @app.route("/")
@@ -229,225 +331,577 @@ def capture_page():
     return render_template('capture.html')
 
 
+def classify_upload(image: BinaryIO, lat: Optional[float], lng: Optional[float]):
+    """Classify an image file, answering repeats of real-model results from the cache.
+
+    Returns (result, cached).
+    """
+    model = classifier.cache_model()
+    key = classification_cache.CacheKey(image, model) if model else None
+    if key is not None:
+        result = classification_cache.get(key)
+        if result is not None:
+            return result, True
+    prepared = imaging.prepare(image)
+    result = classifier.classify(imaging.data_url(prepared.data, prepared.mime), lat, lng)
+    if key is not None and classifier.cacheable(result):
+        classification_cache.put(key, result)
+    return result, False
+
+
+def _wants_async() -> bool:
+    flag = request.args.get('async') or request.form.get('async') or ''
+    return flag.lower() in ('1', 'true', 'yes')
+
+
+def _retry_delay(e: classifier.ClassifierUnavailable) -> float:
+    """Seconds before retrying a deferred classification.
+
+    Never less than a full breaker cooldown: while a half-open trial runs,
+    retry_after is 0 and deferred jobs would otherwise spin.
+    """
+    return max(e.retry_after, classifier.breaker.cooldown) + 1
+
+
+def run_report_job(job_id: str) -> None:
+    """Classify a queued upload and, if invasive, save it like the synchronous path."""
+    if not jobs.claim(job_id):
+        return
+    job = jobs.get_job(job_id)
+    image_path = Path(job['image_path'])
+    try:
+        with open(image_path, 'rb') as image:
+            result, _ = classify_upload(image, job['lat'], job['lng'])
+            saved = None
+            try:
+                if isinstance(result, dict) and result.get('invasive'):
+                    saved = save_report(job['user_id'], job['username'], result, job['lat'], job['lng'],
+                                        image, job['original_filename'])
+            except Exception:
+                saved = None
+        jobs.finish(job_id, result=result, report_id=saved)
+    except classifier.ClassifierUnavailable as e:
+        # Upstream is down; keep the upload (and its queue slot) and try again once the breaker cools off
+        raise jobs.RetryLater(_retry_delay(e))
+    except Exception as e:
+        jobs.finish(job_id, error=str(e))
+    image_path.unlink(missing_ok=True)
+
+
+def queue_report_job(image_file, lat: Optional[float], lng: Optional[float], delay: float = 0):
+    """Persist an upload as a report job and schedule it. Returns (response, status)."""
+    job_id = jobs.new_job_id()
+    pending_path = PENDING_FOLDER / job_id
+    image_file.stream.seek(0)
+    image_file.save(pending_path, UPLOAD_CHUNK_SIZE)
+    jobs.create_job(job_id, getattr(current_user, 'id', None), getattr(current_user, 'username', None),
+                    str(pending_path), image_file.filename, lat, lng)
+    try:
+        if delay:
+            jobs.submit_later(job_id, run_report_job, delay)
+        else:
+            jobs.submit(job_id, run_report_job)
+    except jobs.QueueFull:
+        # Not kept: the client is told to retry, so resuming it later would save the report twice
+        jobs.delete_job(job_id)
+        pending_path.unlink(missing_ok=True)
+        return {"detail": "Classification queue is full, try again shortly"}, 503
+    return {
+        "msg": "queued",
+        "job_id": job_id,
+        "status": jobs.QUEUED,
+        "status_url": url_for('api_report_status', job_id=job_id),
+    }, 202
+
+
+def _parse_coord(raw: Optional[str], limit: float) -> Optional[float]:
+    """A finite coordinate within -limit..limit, or None when missing or invalid (nan, inf, out of range)."""
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) and -limit <= value <= limit else None
+
+
 @app.route("/api/report", methods=["POST"])
 @login_required
 def api_report():
-    """Accept an image upload and forward to OpenAI for analysis (if configured)."""
+    """Accept an image upload and forward to OpenAI for analysis (if configured).
+
+    With ?async=1 (or an 'async' form field) the upload is queued and a job id
+    is returned immediately; poll /api/report/<job_id> for the result.
+    """
     if 'image' not in request.files:
         return jsonify({"detail": "No image provided"}), 400
     image_file = request.files['image']
     if image_file.filename == '':
         return jsonify({"detail": "Empty filename"}), 400
 
-    # Read file bytes
-    content = image_file.read()
-    if not content:
+    # Werkzeug spools large uploads to a temp file; work from that stream
+    # instead of reading the whole image into memory
+    image = image_file.stream
+    head = image.read(16)
+    if not head:
         return jsonify({"detail": "Empty file"}), 400
-
-    # Optionally store temporarily (disabled by default)
-    # upload_dir = Path('uploads'); upload_dir.mkdir(exist_ok=True)
-    # temp_path = upload_dir / image_file.filename
-    # temp_path.write_bytes(content)
+    if imaging.sniff_mime(head) is None:
+        return jsonify({"detail": "Unsupported image type"}), 415
+    image.seek(0, os.SEEK_END)
+    size = image.tell()
+    image.seek(0)
 
     # Optional location
-    lat = request.form.get('lat')
-    lng = request.form.get('lng')
-    try:
-        lat_val = float(lat) if lat is not None else None
-        lng_val = float(lng) if lng is not None else None
-    except ValueError:
-        lat_val, lng_val = None, None
+    lat_val = _parse_coord(request.form.get('lat'), 90.0)
+    lng_val = _parse_coord(request.form.get('lng'), 180.0)
 
-    openai_api_key = os.getenv('OPENAI_API_KEY')
-    if not openai_api_key:
+    if not classifier.is_configured():
         # Return stubbed response if OpenAI is not configured
         return jsonify({
             "msg": "received",
             "openai": "skipped (no OPENAI_API_KEY)",
-            "bytes": len(content)
+            "bytes": size
         }), 200
 
-    # Attempt to send to OpenAI vision model
-    b64 = base64.b64encode(content).decode('utf-8')
-    data_url = f"data:image/jpeg;base64,{b64}"
-    prompt_system = (
-        "You identify species in images. Respond ONLY with strict JSON: "
-        "{\"species\": string, \"invasive\": boolean, \"summary\": string}. "
-        "If unsure, set species='Unknown' and invasive=false, and explain uncertainty in summary."
-    )
-    loc_text = f" The photo was taken near coordinates ({lat_val}, {lng_val})." if (lat_val is not None and lng_val is not None) else ""
-    prompt_user = "Identify the species and whether it is invasive. Provide a summary under 500 chars including distinctive features, typical habitats, your reasonings for your description, and any potential risks." + loc_text
-
-    def extract_json(text: str):
-        if not text:
-            return None
-        try:
-            return json.loads(text)
-        except Exception:
-            pass
-        m = re.search(r"\{[\s\S]*\}", text)
-        if m:
-            try:
-                return json.loads(m.group(0))
-            except Exception:
-                return None
-        return None
+    if _wants_async():
+        body, code = queue_report_job(image_file, lat_val, lng_val)
+        return jsonify(body), code
 
-    # Try new OpenAI SDK first (>=1.0)
     try:
-        from openai import OpenAI  # type: ignore
-        client = OpenAI(api_key=openai_api_key)
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": prompt_system},
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt_user},
-                    {"type": "image_url", "image_url": {"url": data_url}}
-                ]}
-            ],
-            temperature=0.2,
-            max_tokens=600,
-            response_format={"type": "json_object"}
-        )
-        content_text = resp.choices[0].message.content if resp and resp.choices else None
-        parsed = extract_json(content_text)
-        result = parsed or {"species": "Unknown", "invasive": False, "summary": content_text or "No analysis returned"}
-        # Persist if invasive
-        saved = None
-        try:
-            if isinstance(result, dict) and result.get('invasive'):
-                ts = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
-                base_name = secure_filename(image_file.filename) or 'upload.jpg'
-                fname = f"{ts}_{base_name}"
-                out_path = Path(app.config['UPLOAD_FOLDER']) / fname
-                with open(out_path, 'wb') as f:
-                    f.write(content)
-                conn = sqlite3.connect(auth_module._db_path())
-                cur = conn.cursor()
-                cur.execute(
-                    """
-                    INSERT INTO reports (user_id, username, species, invasive, summary, lat, lng, image_filename, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        getattr(current_user, 'id', None),
-                        getattr(current_user, 'username', None),
-                        result.get('species') or 'Unknown',
-                        1,
-                        result.get('summary') or '',
-                        lat_val,
-                        lng_val,
-                        fname,
-                        datetime.utcnow().isoformat()
-                    )
-                )
-                conn.commit()
-                saved = cur.lastrowid
-                conn.close()
-                # Award XP for correct invasive report
-                try:
-                    award_xp(getattr(current_user, 'id', None), XP_PER_INVASIVE)
-                except Exception:
-                    pass
-        except Exception:
-            saved = None
-        return jsonify({"msg": "received", "result": result, "saved_report_id": saved}), 200
+        result, cached = classify_upload(image, lat_val, lng_val)
+    except classifier.ClassifierUnavailable as e:
+        # Fail fast while upstream is down: defer instead of pinning this worker
+        delay = _retry_delay(e)
+        body, code = queue_report_job(image_file, lat_val, lng_val, delay=delay)
+        if code == 503:
+            return jsonify(body), code
+        body["msg"] = "deferred"
+        body["retry_after"] = round(delay)
+        return jsonify(body), code
+    except Exception as e:
+        return jsonify({"msg": "received", "openai_error": str(e)}), 200
+    # Persist if invasive
+    saved = None
+    try:
+        if isinstance(result, dict) and result.get('invasive'):
+            saved = save_report(
+                getattr(current_user, 'id', None),
+                getattr(current_user, 'username', None),
+                result, lat_val, lng_val, image, image_file.filename,
+            )
     except Exception:
-        # Fall back to legacy SDK if available
+        saved = None
+    return jsonify({"msg": "received", "result": result, "saved_report_id": saved, "cached": cached}), 200
+
+
+@app.route("/api/report/<job_id>", methods=["GET"])
+@login_required
+def api_report_status(job_id):
+    """Status and result of an asynchronous classification job."""
+    job = jobs.get_job(job_id)
+    if not job or str(job['user_id']) != str(current_user.id):
+        return jsonify({"detail": "Job not found"}), 404
+    return jsonify({
+        "job_id": job['id'],
+        "status": job['status'],
+        "result": job['result'],
+        "saved_report_id": job['report_id'],
+        "error": job['error'],
+        "created_at": job['created_at'],
+        "updated_at": job['updated_at'],
+    }), 200
+
+
+@app.route("/api/reports/batch", methods=["POST"])
+@login_required
+def api_reports_batch():
+    """Classify many uploads at once.
+
+    Multipart fields: repeated 'images' files with matching repeated 'lat'
+    and 'lng' values (same order; blank for unknown). Images are classified
+    concurrently (up to BATCH_PARALLELISM), invasive ones are inserted in a
+    single transaction and XP is awarded in one update.
+    """
+    request.max_content_length = BATCH_MAX_CONTENT_LENGTH
+    files = request.files.getlist('images')
+    if not files:
+        return jsonify({"detail": "No images provided"}), 400
+    if len(files) > BATCH_MAX_IMAGES:
+        return jsonify({"detail": f"At most {BATCH_MAX_IMAGES} images per batch"}), 400
+    lats = request.form.getlist('lat')
+    lngs = request.form.getlist('lng')
+
+    def coord(values, i, limit):
+        return _parse_coord(values[i] if i < len(values) else None, limit)
+
+    items = []
+    results = []
+    for i, image_file in enumerate(files):
+        entry = {"index": i, "filename": image_file.filename}
+        results.append(entry)
+        head = image_file.stream.read(16)
+        image_file.stream.seek(0)
+        if not head:
+            entry["error"] = "Empty file"
+        elif imaging.sniff_mime(head) is None:
+            entry["error"] = "Unsupported image type"
+        else:
+            items.append((entry, image_file, coord(lats, i, 90.0), coord(lngs, i, 180.0)))
+
+    if not classifier.is_configured():
+        for entry, *_ in items:
+            entry["openai"] = "skipped (no OPENAI_API_KEY)"
+        return jsonify({"msg": "received", "results": results, "saved": 0}), 200
+
+    futures = [
+        (entry, image_file, lat, lng, batch_executor.submit(classify_upload, image_file.stream, lat, lng))
+        for entry, image_file, lat, lng in items
+    ]
+    to_save = []
+    for entry, image_file, lat, lng, future in futures:
         try:
-            import importlib
-            openai = importlib.import_module('openai')
-            openai.api_key = openai_api_key
-            resp = openai.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": prompt_system},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": prompt_user},
-                        {"type": "image_url", "image_url": {"url": data_url}}
-                    ]}
-                ],
-                temperature=0.2,
-                max_tokens=600
-            )
-            content_text = resp.choices[0].message.get('content') if resp and getattr(resp, 'choices', None) else None
-            parsed = extract_json(content_text) if isinstance(content_text, str) else None
-            result = parsed or {"species": "Unknown", "invasive": False, "summary": content_text or "No analysis returned"}
-            saved = None
-            try:
-                if isinstance(result, dict) and result.get('invasive'):
-                    ts = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
-                    base_name = secure_filename(image_file.filename) or 'upload.jpg'
-                    fname = f"{ts}_{base_name}"
-                    out_path = Path(app.config['UPLOAD_FOLDER']) / fname
-                    with open(out_path, 'wb') as f:
-                        f.write(content)
-                    conn = sqlite3.connect(auth_module._db_path())
-                    cur = conn.cursor()
-                    cur.execute(
-                        """
-                        INSERT INTO reports (user_id, username, species, invasive, summary, lat, lng, image_filename, created_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """,
-                        (
-                            getattr(current_user, 'id', None),
-                            getattr(current_user, 'username', None),
-                            result.get('species') or 'Unknown',
-                            1,
-                            result.get('summary') or '',
-                            lat_val,
-                            lng_val,
-                            fname,
-                            datetime.utcnow().isoformat()
-                        )
-                    )
-                    conn.commit()
-                    saved = cur.lastrowid
-                    conn.close()
-                    try:
-                        award_xp(getattr(current_user, 'id', None), XP_PER_INVASIVE)
-                    except Exception:
-                        pass
-            except Exception:
-                saved = None
-            return jsonify({"msg": "received", "result": result, "saved_report_id": saved}), 200
+            result, cached = future.result()
+        except classifier.ClassifierUnavailable as e:
+            delay = _retry_delay(e)
+            body, code = queue_report_job(image_file, lat, lng, delay=delay)
+            if code == 503:
+                entry["openai_error"] = body["detail"]
+            else:
+                entry.update({"msg": "deferred", "job_id": body["job_id"], "retry_after": round(delay)})
+            continue
         except Exception as e:
-            return jsonify({"msg": "received", "openai_error": str(e)}), 200
-
-    # If we reached here, we already returned JSON above. The code below is just to satisfy type checkers.
+            entry["openai_error"] = str(e)
+            continue
+        entry.update({"result": result, "cached": cached, "saved_report_id": None})
+        if isinstance(result, dict) and result.get('invasive'):
+            to_save.append((entry, (result, lat, lng, image_file.stream, image_file.filename)))
 
+    created = 0
+    try:
+        saved = save_reports(
+            getattr(current_user, 'id', None),
+            getattr(current_user, 'username', None),
+            [item for _, item in to_save],
+        )
+        for (entry, _), (report_id, is_new) in zip(to_save, saved):
+            entry["saved_report_id"] = report_id
+            if not is_new:
+                entry["duplicate"] = True
+        created = sum(is_new for _, is_new in saved)
+    except Exception:
+        created = 0
+    return jsonify({
+        "msg": "received",
+        "results": results,
+        "saved": created,
+        "xp_awarded": XP_PER_INVASIVE * created,
+    }), 200
 
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    if filename.startswith('pending/'):
+        return jsonify({"detail": "Not found"}), 404
+    digest = storage.digest_of(filename)
+    if digest is None:
+        # Legacy timestamped names: mtime-based validators, revalidate hourly
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=UPLOAD_LEGACY_MAX_AGE)
+    # A content address never changes, so its hash is a strong ETag and the response is immutable;
+    # conditional=True answers If-None-Match with 304 and Range with 206
+    resp = send_from_directory(app.config['UPLOAD_FOLDER'], filename, etag=digest, conditional=True,
+                               max_age=assets.IMMUTABLE_MAX_AGE)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+
+@app.route('/uploads/derived/<size>/<path:filename>')
+def image_derivative(size, filename):
+    """A display-sized rendition of an upload, generated on first request and cached on disk."""
+    if size not in imaging.DERIVATIVES or filename.startswith(('pending/', storage.DERIVED_DIR + '/')):
+        return jsonify({"detail": "Not found"}), 404
+    rel = storage.derivative(app.config['UPLOAD_FOLDER'], filename, size)
+    if rel is None:
+        # Not renderable here (missing, or no Pillow): serve the original instead
+        return uploaded_file(filename)
+    digest = storage.digest_of(filename)
+    if digest is None:
+        return send_from_directory(app.config['UPLOAD_FOLDER'], rel, max_age=UPLOAD_LEGACY_MAX_AGE)
+    resp = send_from_directory(app.config['UPLOAD_FOLDER'], rel, etag=f"{digest}-{size}", conditional=True,
+                               max_age=assets.IMMUTABLE_MAX_AGE)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+
+def _image_url_builder():
+    """Return filename -> {"image_url", "image_urls"} with url_for resolved once per request, not per row."""
+    # Stored names are hex digests or secure_filename() output, so no per-name quoting is needed
+    original = url_for('uploaded_file', filename='_')[:-1]
+    sized = {size: url_for('image_derivative', size=size, filename='_')[:-1] for size in imaging.DERIVATIVES}
+
+    def build(filename: Optional[str]) -> dict:
+        if not filename:
+            return {"image_url": None, "image_urls": None}
+        return {
+            "image_url": original + filename,
+            "image_urls": {size: prefix + filename for size, prefix in sized.items()},
+        }
+    return build
+
+
+def _report_projection(fields):
+    """SELECT list and row -> dict serializer for a set of REPORT_FIELDS.
+
+    r.id is always selected first (and always returned) since cursors are
+    built from it; every other column is read only when a field needs it.
+    """
+    columns = ["r.id"]
+    for name in fields:
+        column = REPORT_FIELDS[name]
+        if column is not None and column not in columns:
+            columns.append(column)
+    plain = [("id", 0)] + [(name, columns.index(REPORT_FIELDS[name])) for name in fields
+                           if name != "id" and REPORT_FIELDS[name] not in (None, "r.image_filename")]
+    image_fields = [name for name in fields if REPORT_FIELDS[name] == "r.image_filename"]
+    image_at = columns.index("r.image_filename") if image_fields else None
+    image_urls = _image_url_builder() if image_fields else None
+    with_invasive = "invasive" in fields
+
+    def serialize(row) -> dict:
+        item = {name: row[i] for name, i in plain}
+        if with_invasive:
+            item["invasive"] = True
+        if image_at is not None:
+            urls = image_urls(row[image_at])
+            for name in image_fields:
+                item[name] = urls[name]
+        return item
+    return ", ".join(columns), serialize
+
+
+def _parse_bbox(raw: str):
+    """Parse 'min_lat,min_lng,max_lat,max_lng' into a tuple of floats, or None if invalid."""
+    try:
+        min_lat, min_lng, max_lat, max_lng = (float(p) for p in raw.split(','))
+    except ValueError:
+        return None
+    if not (-90.0 <= min_lat <= max_lat <= 90.0):
+        return None
+    if not (-180.0 <= min_lng <= 180.0 and -180.0 <= max_lng <= 180.0):
+        return None
+    return min_lat, min_lng, max_lat, max_lng
+
+
+def _parse_report_id(raw: str):
+    """Parse a report id cursor, or None if it isn't an integer SQLite can bind (0..2**63-1)."""
+    try:
+        value = int(raw)
+    except ValueError:
+        return None
+    if not 0 <= value <= MAX_REPORT_ID:
+        return None
+    return value
 
 
 @app.route("/api/reports", methods=["GET"])
 def get_reports():
-    """Return invasive reports for map consumption (public feed)."""
-    conn = sqlite3.connect(auth_module._db_path())
-    cur = conn.cursor()
-    cur.execute("SELECT id, species, invasive, summary, lat, lng, image_filename, created_at, username FROM reports WHERE invasive = 1 ORDER BY id DESC")
+    """Return invasive reports for map consumption (public feed).
+
+    Optional query params:
+      bbox=min_lat,min_lng,max_lat,max_lng  restrict to a viewport (served from the R*Tree index);
+                                            min_lng > max_lng means the box crosses the antimeridian
+      limit=N                               page size (default REPORTS_DEFAULT_LIMIT, max REPORTS_MAX_LIMIT)
+      before_id=N                           keyset cursor: the next page of older reports, newest first;
+                                            pass back next_before_id until it comes back null
+      since_id=N                            delta mode: only reports with id > N, oldest first, so the
+                                            returned last_id can be passed back as the next cursor
+      fields=a,b,...                        project to these REPORT_FIELDS (id is always included),
+                                            e.g. fields=id,lat,lng,species for map markers
+
+    Responses carry an ETag derived from the newest report id; a matching
+    If-None-Match is answered with 304 before any rows are read.
+    """
+    bbox = None
+    raw_bbox = request.args.get('bbox')
+    if raw_bbox:
+        bbox = _parse_bbox(raw_bbox)
+        if bbox is None:
+            return jsonify({"detail": "bbox must be min_lat,min_lng,max_lat,max_lng"}), 400
+    limit = REPORTS_DEFAULT_LIMIT
+    raw_limit = request.args.get('limit')
+    if raw_limit:
+        try:
+            limit = int(raw_limit)
+        except ValueError:
+            return jsonify({"detail": "limit must be an integer"}), 400
+        if limit < 1:
+            return jsonify({"detail": "limit must be positive"}), 400
+    limit = min(limit, REPORTS_MAX_LIMIT)
+    cursors = {}
+    for name in ('since_id', 'before_id'):
+        raw = request.args.get(name)
+        if raw:
+            cursors[name] = _parse_report_id(raw)
+            if cursors[name] is None:
+                return jsonify({"detail": f"{name} must be a report id"}), 400
+    if len(cursors) > 1:
+        return jsonify({"detail": "since_id and before_id are mutually exclusive"}), 400
+    since_id = cursors.get('since_id')
+    before_id = cursors.get('before_id')
+    fields = list(REPORT_FIELDS)
+    raw_fields = request.args.get('fields')
+    if raw_fields:
+        fields = list(dict.fromkeys(f.strip() for f in raw_fields.split(',') if f.strip()))
+        unknown = [f for f in fields if f not in REPORT_FIELDS]
+        if unknown:
+            return jsonify({"detail": f"Unknown fields: {', '.join(unknown)}"}), 400
+
+    cur = db.get_db().cursor()
+    # The feed is append-only, so the newest id identifies its state
+    cur.execute("SELECT MAX(id) FROM reports")
+    max_id = cur.fetchone()[0] or 0
+    etag = f"reports-{max_id}"
+    if request.if_none_match.contains(etag):
+        resp = make_response('', 304)
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+
+    columns, serialize = _report_projection(fields)
+    # Without a bbox this is a range walk over idx_reports_invasive_id (invasive, id)
+    where = ["r.invasive = 1"]
+    params = []
+    if bbox:
+        min_lat, min_lng, max_lat, max_lng = bbox
+        if min_lng <= max_lng:
+            lng_clause = "t.max_lng >= ? AND t.min_lng <= ?"
+        else:
+            lng_clause = "(t.max_lng >= ? OR t.min_lng <= ?)"
+        source = "reports_rtree t JOIN reports r ON r.id = t.id"
+        where[:0] = ["t.max_lat >= ? AND t.min_lat <= ?", lng_clause]
+        params.extend([min_lat, max_lat, min_lng, max_lng])
+    else:
+        source = "reports r"
+    if since_id is not None:
+        where.append("r.id > ?")
+        params.append(since_id)
+    elif before_id is not None:
+        where.append("r.id < ?")
+        params.append(before_id)
+    order = "ASC" if since_id is not None else "DESC"
+    sql = f"SELECT {columns} FROM {source} WHERE {' AND '.join(where)} ORDER BY r.id {order} LIMIT ?"
+    params.append(limit)
+
+    cur.execute(sql, params)
     rows = cur.fetchall()
-    conn.close()
-    items = []
-    for r in rows:
-        id_, species, invasive, summary, lat, lng, image_filename, created_at, username = r
-        image_url = url_for('uploaded_file', filename=image_filename) if image_filename else None
-        items.append({
-            "id": id_,
-            "species": species,
-            "invasive": bool(invasive),
-            "summary": summary,
-            "lat": lat,
-            "lng": lng,
-            "image_url": image_url,
-            "created_at": created_at,
-            "username": username,
-        })
-    return jsonify({"reports": items}), 200
+    items = [serialize(row) for row in rows]
+    full_page = len(rows) == limit
+    if since_id is not None and full_page:
+        # Truncated delta: resume right after the last row sent
+        last_id = rows[-1][0]
+    else:
+        last_id = max(max_id, since_id or 0)
+    next_before_id = rows[-1][0] if full_page and since_id is None else None
+    resp = make_response(jsonify({"reports": items, "last_id": last_id, "next_before_id": next_before_id}), 200)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
+_stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONNECTIONS)
+
+
+@app.route("/api/reports/stream", methods=["GET"])
+def stream_reports():
+    """Server-Sent Events feed of new invasive reports, as marker fields.
+
+    Event ids are report ids. A reconnect's Last-Event-ID (or ?last_id= on
+    the first connect) replays everything after it before going live;
+    without either the stream starts at the current newest report.
+    """
+    raw_last = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    last_id = None
+    if raw_last:
+        last_id = _parse_report_id(raw_last)
+        if last_id is None:
+            return jsonify({"detail": "Last-Event-ID must be a report id"}), 400
+    if not _stream_slots.acquire(blocking=False):
+        return _busy_response()
+    image_urls = _image_url_builder()
+
+    def message(event: dict) -> str:
+        item = {"id": event["id"], "species": event["species"], "lat": event["lat"], "lng": event["lng"],
+                "invasive": True, **image_urls(event["image_filename"])}
+        return f"id: {event['id']}\nevent: report\ndata: {json.dumps(item, separators=(',', ':'))}\n\n"
+
+    def generate():
+        after = last_id
+        catching_up = after is not None
+        if after is None:
+            with db.borrowed() as conn:
+                after = conn.execute("SELECT COALESCE(MAX(id), 0) FROM reports").fetchone()[0]
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            if catching_up:
+                # Resuming, or fell behind the broker's buffer: replay from the table
+                with db.borrowed() as conn:
+                    batch = events.rows_since(conn, after)
+                catching_up = len(batch) == events.REPLAY_LIMIT
+            else:
+                batch = events.broker.wait(after, STREAM_HEARTBEAT_SECONDS)
+                if batch is None:
+                    catching_up = True
+                    continue
+                if not batch:
+                    yield ": keep-alive\n\n"
+                    continue
+            for event in batch:
+                yield message(event)
+            if batch:
+                after = batch[-1]["id"]
+
+    # The stream borrows connections per query; don't hold the request's for its lifetime
+    db.close_db()
+    resp = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    # Runs however the response ends, even if the generator never started
+    resp.call_on_close(_stream_slots.release)
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return resp
+
+
+@app.route("/api/reports/<int:report_id>", methods=["GET"])
+def get_report(report_id):
+    """Return one report with every field, for popups opened from a projected feed."""
+    columns, serialize = _report_projection(list(REPORT_FIELDS))
+    cur = db.get_db().cursor()
+    cur.execute(f"SELECT {columns} FROM reports r WHERE r.id = ? AND r.invasive = 1", (report_id,))
+    row = cur.fetchone()
+    if row is None:
+        return jsonify({"detail": "Report not found"}), 404
+    return jsonify(serialize(row)), 200
+
+
+@app.route("/api/reports/clusters", methods=["GET"])
+def get_report_clusters():
+    """Return pre-aggregated report cells for low zoom levels.
+
+    Query params: zoom (0..CLUSTER_MAX_ZOOM, map zoom level) and
+    bbox=min_lat,min_lng,max_lat,max_lng. Each cell carries a count,
+    centroid and per-species breakdown.
+    """
+    try:
+        zoom = int(request.args.get('zoom', ''))
+    except ValueError:
+        return jsonify({"detail": "zoom must be an integer"}), 400
+    if not 0 <= zoom <= clusters.CLUSTER_MAX_ZOOM:
+        return jsonify({"detail": f"zoom must be between 0 and {clusters.CLUSTER_MAX_ZOOM}"}), 400
+    raw_bbox = request.args.get('bbox')
+    bbox = _parse_bbox(raw_bbox) if raw_bbox else (-90.0, -180.0, 90.0, 180.0)
+    if bbox is None:
+        return jsonify({"detail": "bbox must be min_lat,min_lng,max_lat,max_lng"}), 400
+    data = clusters.query(db.get_db(), zoom, bbox)
+    return jsonify(data), 200
 
 
 @app.route("/api/profile", methods=["GET"])
@@ -457,37 +911,102 @@ def api_profile():
     return jsonify(prof), 200
 
 
+@app.route("/api/leaderboard", methods=["GET"])
+def api_leaderboard():
+    """Top contributors by earned XP, plus the caller's own rank when logged in.
+
+    Query params: period=all|week|month (default all), limit=N (max LEADERBOARD_MAX_LIMIT).
+    """
+    period = request.args.get('period', leaderboard.ALL)
+    if period not in leaderboard.PERIODS:
+        return jsonify({"detail": f"period must be one of {', '.join(leaderboard.PERIODS)}"}), 400
+    try:
+        limit = int(request.args.get('limit', LEADERBOARD_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"detail": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"detail": "limit must be positive"}), 400
+    limit = min(limit, LEADERBOARD_MAX_LIMIT)
+
+    conn = db.get_db()
+    data = {
+        "period": period,
+        "period_key": leaderboard.period_key(period),
+        "top": leaderboard.top(conn, period, limit),
+    }
+    if current_user.is_authenticated:
+        data["me"] = leaderboard.rank(conn, period, current_user.id)
+    return jsonify(data), 200
+
+
+@app.route("/api/stats", methods=["GET"])
+def api_stats():
+    """Report counts from the materialized rollups in stats.py.
+
+    Query params:
+      group=species|day|week|cell  what to count by (default species)
+      species=NAME                 only this species
+      bbox=min_lat,min_lng,max_lat,max_lng  only cells touching this box (STATS_CELL_ZOOM grid)
+      from=YYYY-MM-DD, to=YYYY-MM-DD       inclusive date range
+    """
+    group = request.args.get('group', 'species')
+    if group not in stats.GROUPS:
+        return jsonify({"detail": f"group must be one of {', '.join(stats.GROUPS)}"}), 400
+    bbox = None
+    raw_bbox = request.args.get('bbox')
+    if raw_bbox:
+        bbox = _parse_bbox(raw_bbox)
+        if bbox is None:
+            return jsonify({"detail": "bbox must be min_lat,min_lng,max_lat,max_lng"}), 400
+    dates = {}
+    for name in ('from', 'to'):
+        raw = request.args.get(name)
+        if raw:
+            try:
+                dates[name] = datetime.strptime(raw, '%Y-%m-%d').strftime('%Y-%m-%d')
+            except ValueError:
+                return jsonify({"detail": f"{name} must be a YYYY-MM-DD date"}), 400
+    species = request.args.get('species') or None
+
+    cur = db.get_db().cursor()
+    # Rollups change only when a report is added, so the newest id versions them too
+    cur.execute("SELECT MAX(id) FROM reports")
+    etag = f"stats-{cur.fetchone()[0] or 0}"
+    if request.if_none_match.contains(etag):
+        resp = make_response('', 304)
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+    buckets = stats.query(db.get_db(), group, species=species, bbox=bbox,
+                          start=dates.get('from'), end=dates.get('to'))
+    data = {
+        "group": group,
+        "species": species,
+        "from": dates.get('from'),
+        "to": dates.get('to'),
+        "total": sum(b["count"] for b in buckets),
+        "buckets": buckets,
+    }
+    if group == 'cell':
+        data["cell_zoom"] = stats.STATS_CELL_ZOOM
+    resp = make_response(jsonify(data), 200)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
 @app.route("/api/cosmetics/purchase", methods=["POST"])
 @login_required
 def api_cosmetics_purchase():
     data = request.get_json(force=True, silent=True) or {}
     item_id = data.get('id')
-    item = next((c for c in COSMETICS_STORE if c['id'] == item_id), None)
-    if not item:
-        return jsonify({"detail": "Unknown item"}), 400
-    conn = sqlite3.connect(auth_module._db_path())
-    cur = conn.cursor()
-    cur.execute("SELECT xp_balance, unlocked_cosmetics FROM users WHERE id = ?", (current_user.id,))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        return jsonify({"detail": "User not found"}), 404
-    xp_balance, unlocked_json = row
+    if not isinstance(item_id, str):
+        return jsonify({"detail": "id must be a string"}), 400
     try:
-        unlocked = json.loads(unlocked_json or '[]')
-    except Exception:
-        unlocked = []
-    if item_id in unlocked:
-        conn.close()
-        return jsonify({"detail": "Already owned"}), 400
-    if (xp_balance or 0) < item['cost']:
-        conn.close()
-        return jsonify({"detail": "Not enough XP"}), 400
-    xp_balance -= item['cost']
-    unlocked.append(item_id)
-    cur.execute("UPDATE users SET xp_balance = ?, unlocked_cosmetics = ? WHERE id = ?", (xp_balance, json.dumps(unlocked), current_user.id))
-    conn.commit()
-    conn.close()
+        xp_balance = cosmetics.purchase(current_user.id, item_id)
+    except cosmetics.CosmeticsError as e:
+        return jsonify({"detail": str(e)}), 400
+    unlocked = cosmetics.owned(db.get_db(), current_user.id)
     return jsonify({"ok": True, "xp_balance": xp_balance, "unlocked_cosmetics": unlocked}), 200
 
 
@@ -496,26 +1015,21 @@ def api_cosmetics_purchase():
 def api_cosmetics_equip():
     data = request.get_json(force=True, silent=True) or {}
     item_id = data.get('id')
-    conn = sqlite3.connect(auth_module._db_path())
-    cur = conn.cursor()
-    cur.execute("SELECT unlocked_cosmetics FROM users WHERE id = ?", (current_user.id,))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        return jsonify({"detail": "User not found"}), 404
+    if not isinstance(item_id, str):
+        return jsonify({"detail": "id must be a string"}), 400
     try:
-        unlocked = json.loads(row[0] or '[]')
-    except Exception:
-        unlocked = []
-    if item_id not in unlocked:
-        conn.close()
-        return jsonify({"detail": "Item not owned"}), 400
-    cur.execute("UPDATE users SET active_cosmetic = ? WHERE id = ?", (item_id, current_user.id))
-    conn.commit()
-    conn.close()
+        cosmetics.equip(current_user.id, item_id)
+    except cosmetics.CosmeticsError as e:
+        return jsonify({"detail": str(e)}), 400
     return jsonify({"ok": True, "active_cosmetic": item_id}), 200
 
 
+def _busy_response():
+    resp = jsonify({"detail": "Server busy, try again shortly"})
+    resp.headers['Retry-After'] = '1'
+    return resp, 503
+
+
 @app.route("/api/register", methods=["POST"])
 def register():
     """Register a new user"""
@@ -530,6 +1044,8 @@ def register():
         auth_module.create_user(username, password)
     except ValueError:
         return jsonify({"detail": "user already exists"}), 400
+    except auth_module.HashingBusy:
+        return _busy_response()
     
     return jsonify({"msg": "user created"}), 200
 
@@ -543,13 +1059,33 @@ def api_login():
     
     if not username or not password:
         return jsonify({"detail": "Username and password required"}), 400
+    if not isinstance(username, str) or not isinstance(password, str):
+        return jsonify({"detail": "Incorrect username or password"}), 401
     
+    # Reject floods before spending CPU on password hashing
+    client_ip = request.remote_addr or ''
+    wait = auth_module.login_throttle.check(username, client_ip)
+    if wait:
+        resp = jsonify({"detail": "Too many login attempts, try again later"})
+        resp.headers['Retry-After'] = str(max(1, round(wait)))
+        return resp, 429
+
     user_data = auth_module.get_user(username)
-    if not user_data or not auth_module.verify_password(password, user_data["password"]):
+    try:
+        ok, new_hash = auth_module.verify_and_update(password, user_data["password"]) if user_data else (False, None)
+    except auth_module.HashingBusy:
+        return _busy_response()
+    if not ok:
+        auth_module.login_throttle.record_failure(username, client_ip)
         return jsonify({"detail": "Incorrect username or password"}), 401
+    auth_module.login_throttle.record_success(username)
+    if new_hash:
+        # Stored hash predates the current PASSWORD_HASH_ROUNDS; upgrade it transparently
+        auth_module.update_password_hash(user_data["id"], new_hash)
     
     # Create User object and login with Flask-Login
     user = User(user_data)
+    cache_user(user)
     login_user(user, remember=True)
     session.permanent = True
     
@@ -580,6 +1116,7 @@ def read_me():
 @login_required
 def api_logout():
     """Logout user by clearing secure session"""
+    invalidate_user(current_user.id)
     logout_user()
     session.clear()
     
@@ -592,6 +1129,13 @@ def api_logout():
     return response, 200
 
 
+@app.errorhandler(413)
+def request_too_large(e):
+    """Return JSON when an upload exceeds the request's limit (MAX_CONTENT_LENGTH unless the route set its own)"""
+    limit_mb = (request.max_content_length or 0) // (1024 * 1024)
+    return jsonify({"detail": f"Upload too large (limit {limit_mb} MB)"}), 413
+
+
 @login_manager.unauthorized_handler
 def unauthorized():
     """Handle unauthorized access"""
@@ -601,30 +1145,32 @@ def unauthorized():
 @app.route("/api/openai/health", methods=["GET"])
 def openai_health():
     """Quick readiness check for OpenAI integration without making a billable request."""
-    key = os.getenv('OPENAI_API_KEY')
-    status = {
-        "has_api_key": bool(key),
-        "sdk": None,
-        "import_ok": False,
-    }
-    try:
-        from openai import OpenAI  # type: ignore
-        _ = OpenAI(api_key=key or "")
-        status["sdk"] = "new"
-        status["import_ok"] = True
-    except Exception:
-        try:
-            import importlib
-            _ = importlib.import_module('openai')
-            status["sdk"] = "legacy"
-            status["import_ok"] = True
-        except Exception:
-            status["sdk"] = None
-            status["import_ok"] = False
+    status = {"has_api_key": classifier.is_configured()}
+    status.update(classifier.health())
+    status["cache"] = classification_cache.stats()
+    status["preprocess"] = imaging.stats()
     code = 200 if status["has_api_key"] and status["import_ok"] else 500
     return jsonify(status), code
 
 
+def startup() -> None:
+    """Once-per-process work for a serving process: migrate, build the classifier client, resume jobs."""
+    # Apply schema migrations once per process, not per request
+    auth_module.init_db()
+    # Build the shared classifier client up front rather than on the first upload
+    if classifier.is_configured():
+        classifier.get_client()
+    # Pick up async jobs queued before the last restart
+    jobs.resume_pending(run_report_job)
+
+
+# Under `python app.py`, multiprocessing helpers (the forkserver and the password
+# hashing pool in auth.py) re-import this file as __mp_main__; they must not migrate
+# or run jobs. Imported as a module (gunicorn, scripts) or run directly, start up.
+if __name__ != "__mp_main__":
+    startup()
+
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=5000)
 
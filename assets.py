@@ -0,0 +1,81 @@
+"""Fingerprinted static assets.
+
+scripts/build_assets.py writes content-hashed copies of static/ into
+static/dist together with a manifest. asset_url() maps a source path to
+its built URL (falling back to the plain static file when no build
+exists), and /static/dist/ responses are marked immutable and served
+precompressed when the client accepts br or gzip. The manifest itself keeps
+its name across builds, so it is served with no-cache instead.
+"""
+import json
+import mimetypes
+from pathlib import Path
+from typing import Optional
+
+from flask import request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+DIST_DIR = Path(__file__).resolve().parent / "static" / "dist"
+MANIFEST_NAME = "manifest.json"
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # Fingerprinted names change whenever content does
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))  # Preferred first
+
+_manifest = {"files": {}, "sprites": {}}
+
+
+def load_manifest(path: Optional[Path] = None) -> dict:
+    """(Re)read the build manifest; an absent manifest means serve sources as-is."""
+    global _manifest
+    path = path or DIST_DIR / MANIFEST_NAME
+    try:
+        data = json.loads(path.read_text())
+    except (OSError, ValueError):
+        data = {}
+    _manifest = {"files": data.get("files", {}), "sprites": data.get("sprites", {})}
+    return _manifest
+
+
+def asset_url(filename: str) -> str:
+    """URL for a file under static/, fingerprinted when the asset build has run."""
+    built = _manifest["files"].get(filename)
+    if built is None:
+        return url_for('static', filename=filename)
+    return url_for('dist_asset', filename=built)
+
+
+def sprite_atlas(name: str) -> Optional[dict]:
+    """Atlas URL, size and frame rectangles for a packed sprite set, or None without a build."""
+    atlas = _manifest["sprites"].get(name)
+    if atlas is None:
+        return None
+    return {
+        "url": url_for('dist_asset', filename=atlas["file"]),
+        "width": atlas["width"],
+        "height": atlas["height"],
+        "frames": atlas["frames"],
+    }
+
+
+def send_dist(filename: str):
+    """Serve a built asset, picking a precompressed variant the client accepts."""
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in ENCODINGS:
+        variant = safe_join(str(DIST_DIR), filename + suffix)
+        if request.accept_encodings[encoding] and variant and Path(variant).is_file():
+            resp = send_from_directory(DIST_DIR, filename + suffix, mimetype=mimetype)
+            resp.headers['Content-Encoding'] = encoding
+            break
+    else:
+        resp = send_from_directory(DIST_DIR, filename, mimetype=mimetype)
+    if filename == MANIFEST_NAME:
+        resp.headers['Cache-Control'] = 'no-cache'
+    else:
+        resp.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+
+def init_app(app) -> None:
+    load_manifest()
+    app.add_url_rule('/static/dist/<path:filename>', 'dist_asset', send_dist)
+    app.jinja_env.globals.update(asset_url=asset_url, sprite_atlas=sprite_atlas)
@@ -1,6 +1,10 @@
 from pathlib import Path
+import multiprocessing
 import sqlite3
-from typing import Optional
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
 from datetime import datetime, timedelta
 
 from passlib.context import CryptContext
@@ -8,9 +12,26 @@ from jose import JWTError, jwt
 from dotenv import load_dotenv
 import os
 
+import db
+import migrations
+
 load_dotenv()
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "29000"))  # Existing hashes are upgraded on login
+# Each server worker process has its own pool, so split the cores between them
+# (gunicorn reads its worker count from WEB_CONCURRENCY too); 0 hashes on the request thread
+HASH_WORKERS = int(os.getenv(
+    "PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 1) // max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)))
+))
+HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", str(4 * max(HASH_WORKERS, 1))))  # Hashes in flight
+HASH_WAIT_SECONDS = float(os.getenv("PASSWORD_HASH_WAIT_SECONDS", "5"))  # Wait for a slot before answering 503
+LOGIN_WINDOW_SECONDS = float(os.getenv("LOGIN_WINDOW_SECONDS", "300"))
+LOGIN_MAX_PER_IP = int(os.getenv("LOGIN_MAX_PER_IP", "100"))  # Failed attempts per window from one address
+LOGIN_MAX_FAILURES_PER_USER = int(os.getenv("LOGIN_MAX_FAILURES_PER_USER", "10"))  # Failures per window per username
+
 # Use pbkdf2_sha256 to avoid native bcrypt dependency issues on some setups
-PWD_CONTEXT = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+PWD_CONTEXT = CryptContext(
+    schemes=["pbkdf2_sha256"], deprecated="auto", pbkdf2_sha256__rounds=PASSWORD_HASH_ROUNDS
+)
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
@@ -18,54 +39,143 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
 
 def _db_path() -> Path:
-    return Path(__file__).parent / "db" / "auth.db"
+    return db.db_path()
 
 
 def init_db() -> None:
-    db = _db_path()
-    db.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(db)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
-    conn.commit()
-    conn.close()
+    """Bring the database schema up to date."""
+    migrations.migrate()
+
+
+class HashingBusy(Exception):
+    """Raised when no hashing slot frees up within HASH_WAIT_SECONDS."""
+
+
+_hash_pool: Optional[ProcessPoolExecutor] = None
+_hash_pool_lock = threading.Lock()
+_hash_slots = threading.BoundedSemaphore(max(HASH_QUEUE_LIMIT, 1))
+
+
+def _hash(password: str) -> str:
+    return PWD_CONTEXT.hash(password)
+
+
+def _verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return PWD_CONTEXT.verify_and_update(password, hashed)
+
+
+def _get_hash_pool() -> ProcessPoolExecutor:
+    # Created on first use so each server worker process gets its own pool
+    global _hash_pool
+    if _hash_pool is None:
+        with _hash_pool_lock:
+            if _hash_pool is None:
+                # Never fork: the server process is multi-threaded, and a forked child can
+                # inherit a lock held by another thread and deadlock
+                methods = multiprocessing.get_all_start_methods()
+                ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                _hash_pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=ctx)
+    return _hash_pool
+
+
+def _offload(fn, *args):
+    """Run CPU-bound hashing in the process pool, keeping request threads free."""
+    if HASH_WORKERS <= 0:
+        return fn(*args)
+    if not _hash_slots.acquire(timeout=HASH_WAIT_SECONDS):
+        raise HashingBusy()
+    try:
+        return _get_hash_pool().submit(fn, *args).result()
+    finally:
+        _hash_slots.release()
+
+
+def hash_password(password: str) -> str:
+    return _offload(_hash, password)
 
 
 def create_user(username: str, password: str) -> None:
-    hashed = PWD_CONTEXT.hash(password)
-    conn = sqlite3.connect(_db_path())
-    cur = conn.cursor()
+    hashed = hash_password(password)
     try:
-        cur.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed))
-        conn.commit()
+        with db.transaction() as cur:
+            cur.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed))
     except sqlite3.IntegrityError:
         raise ValueError("user exists")
-    finally:
-        conn.close()
 
 
 def get_user(username: str) -> Optional[dict]:
-    conn = sqlite3.connect(_db_path())
-    cur = conn.cursor()
+    cur = db.get_db().cursor()
     cur.execute("SELECT id, username, password, created_at FROM users WHERE username = ?", (username,))
     row = cur.fetchone()
-    conn.close()
     if not row:
         return None
     return {"id": row[0], "username": row[1], "password": row[2], "created_at": row[3]}
 
 
 def verify_password(plain: str, hashed: str) -> bool:
-    return PWD_CONTEXT.verify(plain, hashed)
+    return _offload(_verify_and_update, plain, hashed)[0]
+
+
+def verify_and_update(plain: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """Check a password; the second item is a replacement hash when the stored one uses old parameters."""
+    return _offload(_verify_and_update, plain, hashed)
+
+
+def update_password_hash(user_id, hashed: str) -> None:
+    with db.transaction() as cur:
+        cur.execute("UPDATE users SET password = ? WHERE id = ?", (hashed, user_id))
+
+
+class LoginThrottle:
+    """Fixed-window limits on failed logins per client address and per username, kept per process.
+
+    Only failures count, so a classroom logging in from behind one NAT is
+    never throttled, while guessing from one address or against one account
+    is cut off; a successful login clears its username's count.
+    """
+
+    def __init__(self, window: float, max_per_ip: int, max_failures_per_user: int, max_keys: int = 100_000):
+        self.window = window
+        self.max_per_ip = max_per_ip
+        self.max_failures_per_user = max_failures_per_user
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._counts = {}  # (kind, key) -> [window_start, count]
+
+    def _bucket(self, key, now: float) -> list:
+        bucket = self._counts.get(key)
+        if bucket is None or now - bucket[0] >= self.window:
+            if len(self._counts) >= self.max_keys:
+                self._prune(now)
+            bucket = self._counts[key] = [now, 0]
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        for key in [k for k, b in self._counts.items() if now - b[0] >= self.window]:
+            del self._counts[key]
+
+    def check(self, username: str, ip: str) -> float:
+        """Returns seconds to wait if this attempt must be rejected, else 0."""
+        now = time.monotonic()
+        with self._lock:
+            for key, limit in ((("user", username.lower()), self.max_failures_per_user), (("ip", ip), self.max_per_ip)):
+                bucket = self._bucket(key, now)
+                if bucket[1] >= limit:
+                    return self.window - (now - bucket[0])
+            return 0.0
+
+    def record_failure(self, username: str, ip: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._bucket(("user", username.lower()), now)[1] += 1
+            self._bucket(("ip", ip), now)[1] += 1
+
+    def record_success(self, username: str) -> None:
+        with self._lock:
+            self._counts.pop(("user", username.lower()), None)
+
+
+login_throttle = LoginThrottle(LOGIN_WINDOW_SECONDS, LOGIN_MAX_PER_IP, LOGIN_MAX_FAILURES_PER_USER)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
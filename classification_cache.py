@@ -0,0 +1,190 @@
+"""Persistent cache of classification results keyed by model and image content.
+
+Entries belong to the model that produced them (see classifier.cache_model),
+so a model change never serves another model's answers; backends without a
+model id (stub, mock) aren't cached at all. Exact matches are looked up by
+SHA-256 of the upload bytes. When Pillow is
+installed a second tier matches near-duplicates (re-encoded or resized
+copies of the same photo) by a 64-bit difference hash, using four 16-bit
+bands so candidates come from indexed equality lookups rather than a scan.
+Entries expire after CACHE_TTL_SECONDS and the oldest are evicted beyond
+CACHE_MAX_ENTRIES.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import BinaryIO, Optional
+
+import db
+
+try:
+    from PIL import Image
+except Exception:  # Pillow is optional; only the exact tier is used without it
+    Image = None
+
+CACHE_TTL_SECONDS = int(os.getenv("CLASSIFY_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("CLASSIFY_CACHE_MAX_ENTRIES", "50000"))
+PHASH_MAX_DISTANCE = 3  # Bits; <= bands - 1 so a match always shares a band
+# Flat or low-texture images (solid colours, dark frames) hash to nearly all
+# zeros or all ones and would "match" each other; they get the exact tier only
+PHASH_MIN_BITS = 8
+EVICT_EVERY = 100  # Run eviction once per this many puts
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS classification_cache (
+    model TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    phash INTEGER,
+    band0 INTEGER,
+    band1 INTEGER,
+    band2 INTEGER,
+    band3 INTEGER,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (model, content_hash)
+);
+CREATE INDEX IF NOT EXISTS idx_classification_cache_created ON classification_cache (created_at);
+CREATE INDEX IF NOT EXISTS idx_classification_cache_band0 ON classification_cache (band0);
+CREATE INDEX IF NOT EXISTS idx_classification_cache_band1 ON classification_cache (band1);
+CREATE INDEX IF NOT EXISTS idx_classification_cache_band2 ON classification_cache (band2);
+CREATE INDEX IF NOT EXISTS idx_classification_cache_band3 ON classification_cache (band3);
+"""
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "near_hits": 0, "misses": 0, "puts": 0}
+
+
+class CacheKey:
+    """Model id and hashes for one upload file; the perceptual hash is computed on first use."""
+
+    __slots__ = ("model", "image", "sha256", "_phash", "_phash_done")
+
+    def __init__(self, image: BinaryIO, model: str):
+        self.model = model
+        self.image = image
+        image.seek(0)
+        self.sha256 = hashlib.file_digest(image, "sha256").hexdigest()
+        self._phash = None
+        self._phash_done = False
+
+    @property
+    def phash(self) -> Optional[int]:
+        """The upload's dHash, or None when it is missing or too degenerate to compare."""
+        if not self._phash_done:
+            value = dhash(self.image)
+            if value is not None and not informative(value):
+                value = None
+            self._phash = value
+            self._phash_done = True
+        return self._phash
+
+
+def dhash(image: BinaryIO) -> Optional[int]:
+    """64-bit difference hash as a signed SQLite integer, or None without Pillow / for undecodable input."""
+    if Image is None:
+        return None
+    try:
+        image.seek(0)
+        with Image.open(image) as img:
+            img.draft("L", (64, 64))
+            px = list(img.convert("L").resize((9, 8)).getdata())
+    except Exception:
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def informative(phash: int) -> bool:
+    """Whether a hash has enough set and clear bits for near-duplicate matching to mean anything."""
+    bits = bin(phash & 0xFFFFFFFFFFFFFFFF).count("1")
+    return PHASH_MIN_BITS <= bits <= 64 - PHASH_MIN_BITS
+
+
+def _bands(phash: int):
+    unsigned = phash & 0xFFFFFFFFFFFFFFFF
+    return [(unsigned >> (16 * i)) & 0xFFFF for i in range(4)]
+
+
+def _count(name: str) -> None:
+    with _lock:
+        _counters[name] += 1
+
+
+def get(key: CacheKey) -> Optional[dict]:
+    """Return the cached result for an upload, or None on a miss."""
+    cutoff = time.time() - CACHE_TTL_SECONDS
+    cur = db.get_db().cursor()
+    cur.execute(
+        "SELECT result FROM classification_cache WHERE model = ? AND content_hash = ? AND created_at >= ?",
+        (key.model, key.sha256, cutoff),
+    )
+    row = cur.fetchone()
+    if row:
+        _count("hits")
+        return json.loads(row[0])
+    phash = key.phash
+    if phash is not None:
+        b = _bands(phash)
+        cur.execute(
+            """
+            SELECT phash, result FROM classification_cache
+            WHERE (band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?) AND model = ? AND created_at >= ?
+            """,
+            (b[0], b[1], b[2], b[3], key.model, cutoff),
+        )
+        for other, result in cur.fetchall():
+            if other is not None and informative(other) and bin((other ^ phash) & 0xFFFFFFFFFFFFFFFF).count("1") <= PHASH_MAX_DISTANCE:
+                _count("near_hits")
+                return json.loads(result)
+    _count("misses")
+    return None
+
+
+def put(key: CacheKey, result: dict) -> None:
+    phash = key.phash
+    bands = _bands(phash) if phash is not None else [None] * 4
+    with db.transaction() as cur:
+        cur.execute(
+            """
+            INSERT OR REPLACE INTO classification_cache
+                (model, content_hash, phash, band0, band1, band2, band3, result, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (key.model, key.sha256, phash, *bands, json.dumps(result), time.time()),
+        )
+    with _lock:
+        _counters["puts"] += 1
+        due = _counters["puts"] % EVICT_EVERY == 0
+    if due:
+        evict()
+
+
+def evict() -> int:
+    """Drop expired entries and the oldest ones beyond CACHE_MAX_ENTRIES. Returns rows removed."""
+    with db.transaction() as cur:
+        cur.execute("DELETE FROM classification_cache WHERE created_at < ?", (time.time() - CACHE_TTL_SECONDS,))
+        removed = cur.rowcount
+        cur.execute(
+            """
+            DELETE FROM classification_cache WHERE rowid IN (
+                SELECT rowid FROM classification_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (CACHE_MAX_ENTRIES,),
+        )
+        removed += cur.rowcount
+    return removed
+
+
+def stats() -> dict:
+    with _lock:
+        data = dict(_counters)
+    lookups = data["hits"] + data["near_hits"] + data["misses"]
+    data["hit_rate"] = (data["hits"] + data["near_hits"]) / lookups if lookups else 0.0
+    data["perceptual"] = Image is not None
+    return data
@@ -0,0 +1,360 @@
+"""Species classification backends.
+
+CLASSIFIER_BACKEND selects where images are sent:
+  openai  the OpenAI vision API (default; needs OPENAI_API_KEY)
+  mock    a local HTTP server such as scripts/mock_classifier.py, which
+          simulates latency and error rates
+  stub    a deterministic in-process answer derived from the image hash,
+          for exercising the persistence path offline
+
+One backend is built per process and reused, so the underlying HTTP
+connection pool stays warm. Calls use explicit connect/read timeouts and
+bounded retries with exponential backoff. A circuit breaker trips after
+repeated upstream failures and makes calls fail fast with
+ClassifierUnavailable until a cool-down has passed.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+BACKEND = os.getenv("CLASSIFIER_BACKEND", "openai")
+MOCK_URL = os.getenv("CLASSIFIER_MOCK_URL", "http://127.0.0.1:8081/classify")
+STUB_INVASIVE_RATE = float(os.getenv("CLASSIFIER_STUB_INVASIVE_RATE", "0.5"))
+MODEL = "gpt-4o-mini"
+CONNECT_TIMEOUT = float(os.getenv("CLASSIFY_CONNECT_TIMEOUT", "5"))  # Seconds
+READ_TIMEOUT = float(os.getenv("CLASSIFY_READ_TIMEOUT", "45"))  # Seconds
+MAX_RETRIES = int(os.getenv("CLASSIFY_MAX_RETRIES", "2"))  # Extra attempts on transient errors
+BACKOFF_BASE = 0.5  # Seconds; doubled per retry, with jitter
+POOL_CONNECTIONS = int(os.getenv("CLASSIFY_POOL_CONNECTIONS", "20"))  # Keep-alive connections
+BREAKER_THRESHOLD = int(os.getenv("CLASSIFY_BREAKER_THRESHOLD", "5"))  # Consecutive failures to trip
+BREAKER_COOLDOWN = float(os.getenv("CLASSIFY_BREAKER_COOLDOWN", "30"))  # Seconds before a trial call
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+PROMPT_SYSTEM = (
+    "You identify species in images. Respond ONLY with strict JSON: "
+    "{\"species\": string, \"invasive\": boolean, \"summary\": string}. "
+    "If unsure, set species='Unknown' and invasive=false, and explain uncertainty in summary."
+)
+PROMPT_USER = (
+    "Identify the species and whether it is invasive. Provide a summary under 500 chars including "
+    "distinctive features, typical habitats, your reasonings for your description, and any potential risks."
+)
+
+
+def api_key() -> Optional[str]:
+    return os.getenv('OPENAI_API_KEY')
+
+
+def is_configured() -> bool:
+    return BACKEND != "openai" or bool(api_key())
+
+
+def extract_json(text: str):
+    if not text:
+        return None
+    try:
+        return json.loads(text)
+    except Exception:
+        pass
+    m = re.search(r"\{[\s\S]*\}", text)
+    if m:
+        try:
+            return json.loads(m.group(0))
+        except Exception:
+            return None
+    return None
+
+
+class Unparsed(dict):
+    """Placeholder result for an upstream answer that wasn't the requested JSON; never cached."""
+
+
+def _unparsed(text: Optional[str]) -> dict:
+    return Unparsed(species="Unknown", invasive=False, summary=text or "No analysis returned")
+
+
+def _messages(data_url: str, lat: Optional[float], lng: Optional[float]) -> list:
+    loc_text = f" The photo was taken near coordinates ({lat}, {lng})." if (lat is not None and lng is not None) else ""
+    return [
+        {"role": "system", "content": PROMPT_SYSTEM},
+        {"role": "user", "content": [
+            {"type": "text", "text": PROMPT_USER + loc_text},
+            {"type": "image_url", "image_url": {"url": data_url}}
+        ]}
+    ]
+
+
+class ClassifierUnavailable(Exception):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"classifier unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open trial call."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                return "half_open"
+            return "open"
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+
+
+class UpstreamError(Exception):
+    """Non-2xx answer from an HTTP backend."""
+
+    def __init__(self, status_code: int, text: str = ""):
+        super().__init__(f"upstream returned {status_code}: {text[:200]}")
+        self.status_code = status_code
+
+
+class OpenAIBackend:
+    """OpenAI SDK handle: the new client if importable, else the legacy module."""
+
+    name = "openai"
+
+    def __init__(self, key: Optional[str]):
+        self.sdk = None
+        self._client = None
+        try:
+            import httpx
+            from openai import OpenAI  # type: ignore
+            timeout = httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+            http_client = httpx.Client(
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=POOL_CONNECTIONS, max_keepalive_connections=POOL_CONNECTIONS),
+            )
+            # Retries are handled here so the breaker sees every failure
+            self._client = OpenAI(api_key=key or "", timeout=timeout, max_retries=0, http_client=http_client)
+            self.sdk = "new"
+        except Exception:
+            import importlib
+            try:
+                openai = importlib.import_module('openai')
+                openai.api_key = key
+                self._client = openai
+                self.sdk = "legacy"
+            except Exception:
+                self.sdk = None
+
+    def classify(self, data_url: str, lat: Optional[float], lng: Optional[float]) -> dict:
+        messages = _messages(data_url, lat, lng)
+        if self.sdk == "new":
+            resp = self._client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=0.2,
+                max_tokens=600,
+                response_format={"type": "json_object"}
+            )
+            content_text = resp.choices[0].message.content if resp and resp.choices else None
+            parsed = extract_json(content_text)
+        elif self.sdk == "legacy":
+            resp = self._client.ChatCompletion.create(
+                model=MODEL,
+                messages=messages,
+                temperature=0.2,
+                max_tokens=600,
+                request_timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+            )
+            content_text = resp.choices[0].message.get('content') if resp and getattr(resp, 'choices', None) else None
+            parsed = extract_json(content_text) if isinstance(content_text, str) else None
+        else:
+            raise RuntimeError("openai SDK not importable")
+        return parsed or _unparsed(content_text)
+
+    def health(self) -> dict:
+        return {"sdk": self.sdk, "import_ok": self.sdk is not None}
+
+
+class MockHTTPBackend:
+    """POSTs {image, lat, lng} as JSON to a local classifier over a keep-alive session."""
+
+    name = "mock"
+
+    def __init__(self, url: str):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.url = url
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_CONNECTIONS, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def classify(self, data_url: str, lat: Optional[float], lng: Optional[float]) -> dict:
+        resp = self._session.post(
+            self.url,
+            json={"image": data_url, "lat": lat, "lng": lng},
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        )
+        if resp.status_code >= 300:
+            raise UpstreamError(resp.status_code, resp.text)
+        parsed = extract_json(resp.text)
+        return parsed or _unparsed(resp.text)
+
+    def health(self) -> dict:
+        return {"url": self.url}
+
+
+STUB_SPECIES = [
+    "Kudzu",
+    "Japanese Knotweed",
+    "Garlic Mustard",
+    "Emerald Ash Borer",
+    "Spotted Lanternfly",
+    "English Ivy",
+]
+
+
+def stub_result(data: bytes, invasive_rate: float = STUB_INVASIVE_RATE) -> dict:
+    """Deterministic classification derived from a hash of the image."""
+    digest = hashlib.sha256(data).digest()
+    species = STUB_SPECIES[digest[0] % len(STUB_SPECIES)]
+    invasive = digest[1] < invasive_rate * 256
+    return {
+        "species": species if invasive else "Unknown",
+        "invasive": invasive,
+        "summary": f"Stub classification ({digest[:4].hex()}).",
+    }
+
+
+class StubBackend:
+    """In-process, network-free backend for load testing the write path."""
+
+    name = "stub"
+
+    def classify(self, data_url: str, lat: Optional[float], lng: Optional[float]) -> dict:
+        return stub_result(data_url.encode("ascii"))
+
+    def health(self) -> dict:
+        return {"invasive_rate": STUB_INVASIVE_RATE}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _build_backend():
+    if BACKEND == "mock":
+        return MockHTTPBackend(MOCK_URL)
+    if BACKEND == "stub":
+        return StubBackend()
+    if BACKEND != "openai":
+        raise ValueError(f"unknown CLASSIFIER_BACKEND {BACKEND!r}")
+    return OpenAIBackend(api_key())
+
+
+def get_client():
+    """Return the shared backend, building it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_backend()
+    return _client
+
+
+def cache_model() -> Optional[str]:
+    """Id of the model answering classify(), for keying cached results.
+
+    None for the stub and mock backends, whose answers must never be served
+    later as real classifications.
+    """
+    client = get_client()
+    return f"{client.name}:{MODEL}" if client.name == OpenAIBackend.name else None
+
+
+def cacheable(result) -> bool:
+    """Whether a classify() result is a real answer worth caching."""
+    return isinstance(result, dict) and not isinstance(result, Unparsed)
+
+
+def _is_transient(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None) or getattr(exc, "http_status", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # Connection errors and timeouts carry no status code
+    name = type(exc).__name__
+    return any(part in name for part in ("Connection", "Timeout", "ServiceUnavailable", "RateLimit"))
+
+
+def classify(data_url: str, lat: Optional[float] = None, lng: Optional[float] = None) -> dict:
+    """Classify an image given as a data URL and return {species, invasive, summary}.
+
+    Raises ClassifierUnavailable while the breaker is open, or the last
+    upstream error once retries are exhausted.
+    """
+    if not breaker.allow():
+        raise ClassifierUnavailable(breaker.retry_after())
+    client = get_client()
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            result = client.classify(data_url, lat, lng)
+        except Exception as e:
+            if not _is_transient(e):
+                # Our request was rejected; upstream itself is fine
+                breaker.record_success()
+                raise
+            if attempt == MAX_RETRIES:
+                breaker.record_failure()
+                raise
+            time.sleep(BACKOFF_BASE * (2 ** attempt) * (0.5 + random.random()))
+        else:
+            breaker.record_success()
+            return result
+
+
+def health() -> dict:
+    client = get_client()
+    status = {"backend": client.name, "sdk": None, "import_ok": True, "breaker": breaker.state}
+    status.update(client.health())
+    return status
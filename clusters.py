@@ -0,0 +1,192 @@
+"""Pre-aggregated map cells for low-zoom clustering.
+
+Reports are bucketed into slippy-map tiles (the same x/y/z scheme the
+OpenStreetMap tile layer uses) for every zoom level up to CLUSTER_MAX_ZOOM.
+Each cell keeps a count, coordinate sums for the centroid and a per-species
+breakdown, updated incrementally as reports are inserted.
+"""
+import math
+import sqlite3
+from typing import Iterable, List, Optional, Tuple
+
+CLUSTER_MAX_ZOOM = 14  # Deepest grid that is maintained
+CLUSTER_CELL_OFFSET = 2  # Cells are tiles of zoom + 2, i.e. ~64px on screen
+MAX_MERCATOR_LAT = 85.05112878
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_cells (
+    zoom INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    sum_lat REAL NOT NULL DEFAULT 0,
+    sum_lng REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (zoom, x, y)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS report_cell_species (
+    zoom INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    species TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (zoom, x, y, species)
+) WITHOUT ROWID;
+"""
+
+
+def tile_xy(lat: float, lng: float, zoom: int) -> Tuple[int, int]:
+    """Return the slippy-map tile containing (lat, lng) at the given zoom."""
+    n = 1 << zoom
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = int((lng + 180.0) / 360.0 * n)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def cell_zoom(zoom: int) -> int:
+    """Grid level used to answer a map at the given zoom."""
+    return max(0, min(zoom + CLUSTER_CELL_OFFSET, CLUSTER_MAX_ZOOM))
+
+
+def _cell_rows(lat: float, lng: float):
+    # Tiles nest exactly: the parent of (x, y) at zoom z + 1 is (x >> 1, y >> 1),
+    # so project once at the deepest level and shift for the rest
+    x, y = tile_xy(lat, lng, CLUSTER_MAX_ZOOM)
+    for z in range(CLUSTER_MAX_ZOOM + 1):
+        shift = CLUSTER_MAX_ZOOM - z
+        yield z, x >> shift, y >> shift
+
+
+def record_report(cur: sqlite3.Cursor, lat: Optional[float], lng: Optional[float], species: Optional[str]) -> None:
+    """Add one report to every cell level. Call inside the insert's transaction."""
+    if lat is None or lng is None:
+        return
+    species = species or 'Unknown'
+    cells = list(_cell_rows(lat, lng))
+    cur.executemany(
+        """
+        INSERT INTO report_cells (zoom, x, y, count, sum_lat, sum_lng) VALUES (?, ?, ?, 1, ?, ?)
+        ON CONFLICT(zoom, x, y) DO UPDATE SET
+            count = count + 1,
+            sum_lat = sum_lat + excluded.sum_lat,
+            sum_lng = sum_lng + excluded.sum_lng
+        """,
+        [(z, x, y, lat, lng) for z, x, y in cells],
+    )
+    cur.executemany(
+        """
+        INSERT INTO report_cell_species (zoom, x, y, species, count) VALUES (?, ?, ?, ?, 1)
+        ON CONFLICT(zoom, x, y, species) DO UPDATE SET count = count + 1
+        """,
+        [(z, x, y, species) for z, x, y in cells],
+    )
+
+
+def rebuild(conn: sqlite3.Connection) -> int:
+    """Recompute all cells from the reports table; the caller commits.
+
+    Reports are aggregated at CLUSTER_MAX_ZOOM and the coarser levels are
+    rolled up from those cells, so each report is projected only once.
+    Returns the number of reports aggregated.
+    """
+    cells = {}
+    species_counts = {}
+    total = 0
+    cur = conn.cursor()
+    cur.execute("SELECT lat, lng, species FROM reports WHERE invasive = 1 AND lat IS NOT NULL AND lng IS NOT NULL")
+    for lat, lng, species in cur:
+        total += 1
+        key = tile_xy(lat, lng, CLUSTER_MAX_ZOOM)
+        agg = cells.get(key)
+        if agg is None:
+            cells[key] = [1, lat, lng]
+        else:
+            agg[0] += 1
+            agg[1] += lat
+            agg[2] += lng
+        skey = key + (species or 'Unknown',)
+        species_counts[skey] = species_counts.get(skey, 0) + 1
+    levels = {CLUSTER_MAX_ZOOM: (cells, species_counts)}
+    for z in range(CLUSTER_MAX_ZOOM - 1, -1, -1):
+        child_cells, child_species = levels[z + 1]
+        parent_cells = {}
+        parent_species = {}
+        for (x, y), (count, sum_lat, sum_lng) in child_cells.items():
+            agg = parent_cells.setdefault((x >> 1, y >> 1), [0, 0.0, 0.0])
+            agg[0] += count
+            agg[1] += sum_lat
+            agg[2] += sum_lng
+        for (x, y, species), count in child_species.items():
+            pkey = (x >> 1, y >> 1, species)
+            parent_species[pkey] = parent_species.get(pkey, 0) + count
+        levels[z] = (parent_cells, parent_species)
+    cur.execute("DELETE FROM report_cells")
+    cur.execute("DELETE FROM report_cell_species")
+    cur.executemany(
+        "INSERT INTO report_cells (zoom, x, y, count, sum_lat, sum_lng) VALUES (?, ?, ?, ?, ?, ?)",
+        ((z, x, y, *agg) for z, (level_cells, _) in levels.items() for (x, y), agg in level_cells.items()),
+    )
+    cur.executemany(
+        "INSERT INTO report_cell_species (zoom, x, y, species, count) VALUES (?, ?, ?, ?, ?)",
+        ((z, *k, v) for z, (_, level_species) in levels.items() for k, v in level_species.items()),
+    )
+    return total
+
+
+def _x_ranges(min_lng: float, max_lng: float, zoom: int) -> Iterable[Tuple[int, int]]:
+    x0, _ = tile_xy(0.0, min_lng, zoom)
+    x1, _ = tile_xy(0.0, max_lng, zoom)
+    if min_lng <= max_lng:
+        return [(x0, x1)]
+    # Box crosses the antimeridian
+    return [(x0, (1 << zoom) - 1), (0, x1)]
+
+
+def tile_ranges(bbox: Tuple[float, float, float, float], zoom: int) -> List[Tuple[int, int, int, int]]:
+    """(x0, x1, y0, y1) tile ranges covering bbox (min_lat, min_lng, max_lat, max_lng)."""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    _, y0 = tile_xy(max_lat, 0.0, zoom)  # tile rows grow southward
+    _, y1 = tile_xy(min_lat, 0.0, zoom)
+    return [(x0, x1, y0, y1) for x0, x1 in _x_ranges(min_lng, max_lng, zoom)]
+
+
+def tile_center(x: int, y: int, zoom: int) -> dict:
+    n = 1 << zoom
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 0.5) / n))))
+    return {"lat": lat, "lng": (x + 0.5) / n * 360.0 - 180.0}
+
+
+def query(conn: sqlite3.Connection, zoom: int, bbox: Tuple[float, float, float, float]) -> dict:
+    """Return aggregated cells intersecting bbox (min_lat, min_lng, max_lat, max_lng) for a map zoom."""
+    cz = cell_zoom(zoom)
+    cur = conn.cursor()
+    cells = {}
+    for x0, x1, y0, y1 in tile_ranges(bbox, cz):
+        params = (cz, x0, x1, y0, y1)
+        cur.execute(
+            "SELECT x, y, count, sum_lat, sum_lng FROM report_cells "
+            "WHERE zoom = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?",
+            params,
+        )
+        for x, y, count, sum_lat, sum_lng in cur.fetchall():
+            if not count:
+                continue
+            cells[(x, y)] = {
+                "x": x,
+                "y": y,
+                "count": count,
+                "lat": sum_lat / count,
+                "lng": sum_lng / count,
+                "species": {},
+            }
+        cur.execute(
+            "SELECT x, y, species, count FROM report_cell_species "
+            "WHERE zoom = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?",
+            params,
+        )
+        for x, y, species, count in cur.fetchall():
+            cell = cells.get((x, y))
+            if cell is not None and count:
+                cell["species"][species] = count
+    return {"zoom": zoom, "cell_zoom": cz, "cells": list(cells.values())}
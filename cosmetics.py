@@ -0,0 +1,69 @@
+"""Cosmetics store and ownership.
+
+The catalog is static and indexed by id at import. Ownership lives in
+user_cosmetics, one row per (user, item), so the primary key rules out
+double grants; a purchase grants and debits in a single BEGIN IMMEDIATE
+transaction.
+"""
+import sqlite3
+from typing import List
+
+import db
+import xp
+
+# Cosmetics catalog (id, label, cost)
+STORE = [
+    {"id": "pot_terracotta", "label": "Terracotta Pot", "cost": 50},
+    {"id": "pot_white", "label": "White Pot", "cost": 100},
+    {"id": "leaves_spring", "label": "Spring Leaves", "cost": 75},
+    {"id": "leaves_autumn", "label": "Autumn Leaves", "cost": 125},
+]
+STORE_BY_ID = {item["id"]: item for item in STORE}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_cosmetics (
+    user_id INTEGER NOT NULL,
+    item_id TEXT NOT NULL,
+    acquired_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, item_id)
+) WITHOUT ROWID;
+"""
+
+
+class CosmeticsError(Exception):
+    """A purchase or equip the user isn't allowed to make; str() is the client-facing detail."""
+
+
+def owned(conn: sqlite3.Connection, user_id) -> List[str]:
+    cur = conn.cursor()
+    cur.execute("SELECT item_id FROM user_cosmetics WHERE user_id = ? ORDER BY acquired_at, item_id", (int(user_id),))
+    return [row[0] for row in cur.fetchall()]
+
+
+def purchase(user_id, item_id: str) -> int:
+    """Grant an item and debit its cost atomically. Returns the new XP balance."""
+    item = STORE_BY_ID.get(item_id)
+    if item is None:
+        raise CosmeticsError("Unknown item")
+    with db.transaction(immediate=True) as cur:
+        cur.execute("INSERT OR IGNORE INTO user_cosmetics (user_id, item_id) VALUES (?, ?)", (int(user_id), item_id))
+        if cur.rowcount != 1:
+            raise CosmeticsError("Already owned")
+        balance = xp.spend(cur, user_id, item["cost"], xp.REASON_COSMETIC, item_id)
+        if balance is None:
+            # Raising rolls back the grant
+            raise CosmeticsError("Not enough XP")
+    return balance
+
+
+def equip(user_id, item_id: str) -> None:
+    with db.transaction() as cur:
+        cur.execute(
+            """
+            UPDATE users SET active_cosmetic = ? WHERE id = ?
+            AND EXISTS (SELECT 1 FROM user_cosmetics WHERE user_id = ? AND item_id = ?)
+            """,
+            (item_id, int(user_id), int(user_id), item_id),
+        )
+        if cur.rowcount != 1:
+            raise CosmeticsError("Item not owned")
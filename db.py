@@ -0,0 +1,122 @@
+"""Shared SQLite access layer.
+
+Connections are opened once with WAL journaling and tuned pragmas, then
+pooled and handed out one per request (or one per thread outside a Flask
+app context). Reusing connections also keeps sqlite3's per-connection
+prepared statement cache warm.
+"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+from flask import g, has_app_context
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "16"))  # Idle connections kept around
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))  # Wait this long on a locked database
+CACHE_SIZE_KIB = int(os.getenv("DB_CACHE_SIZE_KIB", "20000"))  # Page cache per connection
+MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+STATEMENT_CACHE = 256  # Prepared statements cached per connection
+
+_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=POOL_SIZE)
+_local = threading.local()
+
+
+def db_path() -> Path:
+    override = os.getenv("INVASISEE_DB_PATH")  # e.g. a scratch database for benchmarks
+    return Path(override) if override else Path(__file__).parent / "db" / "auth.db"
+
+
+def connect(path: Optional[Path] = None) -> sqlite3.Connection:
+    """Open a new tuned connection. Most callers want get_db() instead."""
+    path = Path(path or db_path())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000.0,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def _acquire() -> sqlite3.Connection:
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return connect()
+
+
+def _release(conn: sqlite3.Connection) -> None:
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        _pool.put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        conn.close()
+
+
+def get_db() -> sqlite3.Connection:
+    """Return the connection bound to the current request, or to this thread outside Flask."""
+    if has_app_context():
+        conn = g.get("_db_conn")
+        if conn is None:
+            conn = g._db_conn = _acquire()
+        return conn
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = connect()
+    return conn
+
+
+def close_db(exc: Optional[BaseException] = None) -> None:
+    """Return the request's connection to the pool (registered as a teardown handler)."""
+    conn = g.pop("_db_conn", None)
+    if conn is not None:
+        _release(conn)
+
+
+@contextmanager
+def borrowed() -> Iterator[sqlite3.Connection]:
+    """A pooled connection for one short block, returned as soon as it ends.
+
+    For long-lived responses (streams) that must not keep the request's
+    connection checked out between queries.
+    """
+    conn = _acquire()
+    try:
+        yield conn
+    finally:
+        _release(conn)
+
+
+def init_app(app) -> None:
+    app.teardown_appcontext(close_db)
+
+
+@contextmanager
+def transaction(conn: Optional[sqlite3.Connection] = None, immediate: bool = False) -> Iterator[sqlite3.Cursor]:
+    """Run a block in one transaction, committing on success and rolling back on error.
+
+    immediate=True takes the write lock up front (BEGIN IMMEDIATE), so a
+    read-then-write block waits on busy_timeout instead of failing with
+    'database is locked' when it tries to upgrade.
+    """
+    conn = conn or get_db()
+    if immediate and not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn.cursor()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
@@ -0,0 +1,127 @@
+"""Live report events for the /api/reports/stream Server-Sent Events feed.
+
+EVENTS_BACKEND selects how committed reports reach open streams:
+  memory  in-process fan-out; save_reports() publishes right after commit,
+          serialised so events arrive in id order (default; one worker)
+  sqlite  one thread per process tails the reports table every
+          EVENTS_POLL_SECONDS, so reports written by any worker process reach
+          every stream; use this under multi-worker gunicorn
+
+Either way streams only wait on a condition variable: a parked tab costs a
+connection, not a query. Event ids are report ids, so a reconnecting
+EventSource's Last-Event-ID is replayed from the reports table with
+rows_since() before it rejoins the live feed.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+import db
+
+BACKEND = os.getenv("EVENTS_BACKEND", "memory")
+BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "1024"))  # Recent events kept for streams that fall behind
+POLL_SECONDS = float(os.getenv("EVENTS_POLL_SECONDS", "0.5"))  # sqlite backend only
+REPLAY_LIMIT = 500  # Rows per rows_since() query
+FIELDS = ("id", "species", "lat", "lng", "image_filename")
+
+
+def rows_since(conn: sqlite3.Connection, after_id: int, limit: int = REPLAY_LIMIT) -> List[dict]:
+    """Invasive reports with id > after_id, oldest first, as event dicts."""
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT {', '.join(FIELDS)} FROM reports WHERE invasive = 1 AND id > ? ORDER BY id LIMIT ?",
+        (after_id, limit),
+    )
+    return [dict(zip(FIELDS, row)) for row in cur.fetchall()]
+
+
+class MemoryBroker:
+    """Fan-out over a bounded buffer of recent events; subscribers track their own position."""
+
+    name = "memory"
+
+    def __init__(self, buffer_size: int = BUFFER_SIZE):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=buffer_size)
+        self._last_id = 0
+        self._floor = 0  # Highest id evicted from the buffer
+
+    def publish(self, events: List[dict]) -> None:
+        with self._cond:
+            for event in events:
+                if event["id"] <= self._last_id:
+                    continue
+                if len(self._events) == self._events.maxlen:
+                    self._floor = self._events[0]["id"]
+                self._events.append(event)
+                self._last_id = event["id"]
+            self._cond.notify_all()
+
+    def wait(self, after_id: int, timeout: float) -> Optional[List[dict]]:
+        """Events newer than after_id, blocking up to timeout for one to arrive.
+
+        Returns None when some of them were already evicted; the caller
+        then catches up with rows_since().
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._last_id > after_id, timeout)
+            if after_id < self._floor:
+                return None
+            return [event for event in self._events if event["id"] > after_id]
+
+
+class SQLiteBroker(MemoryBroker):
+    """MemoryBroker fed by tailing the reports table, so every worker process sees every report."""
+
+    name = "sqlite"
+
+    def __init__(self, buffer_size: int = BUFFER_SIZE, poll_seconds: float = POLL_SECONDS):
+        super().__init__(buffer_size)
+        self._poll_seconds = poll_seconds
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def publish(self, events: List[dict]) -> None:
+        # The tailing thread picks the commit up; publishing here as well could
+        # push the watermark past lower ids another process is about to commit
+        pass
+
+    def wait(self, after_id: int, timeout: float) -> Optional[List[dict]]:
+        self._ensure_tailing()
+        return super().wait(after_id, timeout)
+
+    def _ensure_tailing(self) -> None:
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                conn = db.connect()
+                cur = conn.cursor()
+                cur.execute("SELECT COALESCE(MAX(id), 0) FROM reports")
+                self._last_id = self._floor = cur.fetchone()[0]
+                self._thread = threading.Thread(target=self._tail, args=(conn,), name="events-tail", daemon=True)
+                self._thread.start()
+
+    def _tail(self, conn: sqlite3.Connection) -> None:
+        while True:
+            time.sleep(self._poll_seconds)
+            try:
+                batch = rows_since(conn, self._last_id)
+            except sqlite3.Error:
+                continue
+            if batch:
+                super().publish(batch)
+
+
+def _build_broker():
+    if BACKEND == "memory":
+        return MemoryBroker()
+    if BACKEND == "sqlite":
+        return SQLiteBroker()
+    raise ValueError(f"unknown EVENTS_BACKEND {BACKEND!r}")
+
+
+broker = _build_broker()
@@ -0,0 +1,153 @@
+"""Image preprocessing before classification.
+
+Uploads are decoded, rotated according to their EXIF orientation,
+downscaled so the longest side is at most CLASSIFY_MAX_DIM and re-encoded
+as JPEG at CLASSIFY_JPEG_QUALITY. The vision model does not need phone
+camera resolution, and the smaller payload cuts request size and latency.
+Without Pillow the original bytes are passed through with their sniffed
+MIME type.
+
+The same pipeline renders the display derivatives (DERIVATIVES) that map
+markers and popups load instead of the original photo.
+"""
+import base64
+import io
+import os
+import threading
+from typing import BinaryIO, NamedTuple, Optional
+
+try:
+    from PIL import Image, ImageOps
+except Exception:  # Pillow is optional; fall back to pass-through
+    Image = None
+    ImageOps = None
+
+CLASSIFY_MAX_DIM = int(os.getenv("CLASSIFY_MAX_DIM", "1024"))
+CLASSIFY_JPEG_QUALITY = int(os.getenv("CLASSIFY_JPEG_QUALITY", "80"))
+DERIVATIVE_JPEG_QUALITY = int(os.getenv("DERIVATIVE_JPEG_QUALITY", "75"))
+# name -> (longest side in px, center-crop to a square); sized for 2x displays
+DERIVATIVES = {
+    "thumb": (96, True),  # 40px map marker
+    "medium": (480, False),  # 220px popup
+}
+
+_lock = threading.Lock()
+_counters = {"images": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+class Prepared(NamedTuple):
+    data: bytes
+    mime: str
+    bytes_saved: int
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    """Identify an image type from its leading magic bytes."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1", b"hevc"):
+        return "image/heic"
+    return None
+
+
+def _record(bytes_in: int, bytes_out: int) -> None:
+    with _lock:
+        _counters["images"] += 1
+        _counters["bytes_in"] += bytes_in
+        _counters["bytes_out"] += bytes_out
+
+
+def _passthrough(image: BinaryIO, mime: str, size: int) -> Prepared:
+    image.seek(0)
+    _record(size, size)
+    return Prepared(image.read(), mime, 0)
+
+
+def _flatten(img):
+    """Convert to RGB, compositing any transparency onto white."""
+    if img.mode in ("RGBA", "LA", "P"):
+        rgba = img.convert("RGBA")
+        img = Image.new("RGB", rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.split()[-1])
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    return img
+
+
+def prepare(image: BinaryIO) -> Prepared:
+    """Return the payload to send for classification and its MIME type.
+
+    Reads from a seekable file so the original upload never has to be held
+    in memory; only the (small) re-encoded result is returned as bytes.
+    """
+    image.seek(0)
+    mime = sniff_mime(image.read(16)) or "image/jpeg"
+    size = image.seek(0, os.SEEK_END)
+    image.seek(0)
+    if Image is None:
+        return _passthrough(image, mime, size)
+    try:
+        with Image.open(image) as img:
+            original_size = img.size
+            rotated = img.getexif().get(0x0112, 1) != 1
+            # Let the JPEG decoder skip detail we'll throw away anyway
+            img.draft("RGB", (CLASSIFY_MAX_DIM, CLASSIFY_MAX_DIM))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((CLASSIFY_MAX_DIM, CLASSIFY_MAX_DIM))
+            img = _flatten(img)
+            out = io.BytesIO()
+            unchanged = img.size == original_size and not rotated
+            img.save(out, "JPEG", quality=CLASSIFY_JPEG_QUALITY, optimize=True)
+    except Exception:
+        # Undecodable here (e.g. HEIC without a plugin); send as-is and let the API decide
+        return _passthrough(image, mime, size)
+    if unchanged and out.tell() >= size and mime in ("image/jpeg", "image/png"):
+        # Already small and upright; re-encoding would only cost quality
+        return _passthrough(image, mime, size)
+    data = out.getvalue()
+    _record(size, len(data))
+    return Prepared(data, "image/jpeg", size - len(data))
+
+
+def render_derivative(image: BinaryIO, name: str) -> Optional[bytes]:
+    """Render one of DERIVATIVES as JPEG bytes, or None when it can't be decoded here."""
+    if Image is None:
+        return None
+    max_dim, crop = DERIVATIVES[name]
+    try:
+        with Image.open(image) as img:
+            img.draft("RGB", (max_dim, max_dim))
+            img = ImageOps.exif_transpose(img)
+            if crop:
+                img = ImageOps.fit(img, (max_dim, max_dim))
+            else:
+                img.thumbnail((max_dim, max_dim))
+            out = io.BytesIO()
+            _flatten(img).save(out, "JPEG", quality=DERIVATIVE_JPEG_QUALITY, optimize=True, progressive=True)
+    except Exception:
+        return None
+    return out.getvalue()
+
+
+def data_url(data: bytes, mime: str) -> str:
+    """Build a base64 data URL, encoding in chunks to avoid intermediate full-size copies."""
+    buf = bytearray(b"data:" + mime.encode("ascii") + b";base64,")
+    view = memoryview(data)
+    step = 3 * 16 * 1024  # Multiple of 3 so chunks concatenate without padding
+    for start in range(0, len(view), step):
+        buf += base64.b64encode(view[start:start + step])
+    return buf.decode("ascii")
+
+
+def stats() -> dict:
+    with _lock:
+        data = dict(_counters)
+    data["bytes_saved"] = data["bytes_in"] - data["bytes_out"]
+    data["enabled"] = Image is not None
+    return data
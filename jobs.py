@@ -0,0 +1,252 @@
+"""Background classification jobs.
+
+Jobs are rows in report_jobs so any worker process can answer status
+queries; the work itself runs on a bounded in-process thread pool.
+Deferred jobs wait in a heap served by one scheduler thread. Every
+accepted job, running or deferred, holds one of JOB_QUEUE_LIMIT slots
+until it finishes. Jobs resumed at startup that do not fit are picked up
+by later re-scans on the scheduler thread.
+"""
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import db
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # Concurrent classifications
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "64"))  # Queued + running jobs before rejecting
+# A job still "running" this long after its last update belongs to a process that died
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "600"))
+# Leftover jobs that did not fit the queue on resume are re-scanned after this delay, doubling while none fit
+JOB_RESUME_RETRY_SECONDS = float(os.getenv("JOB_RESUME_RETRY_SECONDS", "5"))
+JOB_RESUME_RETRY_MAX_SECONDS = float(os.getenv("JOB_RESUME_RETRY_MAX_SECONDS", "300"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    username TEXT,
+    status TEXT NOT NULL,
+    image_path TEXT,
+    original_filename TEXT,
+    lat REAL,
+    lng REAL,
+    result TEXT,
+    report_id INTEGER,
+    error TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_report_jobs_status ON report_jobs (status);
+"""
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="report-job")
+_slots = threading.BoundedSemaphore(JOB_QUEUE_LIMIT)
+_holding = set()  # Ids of jobs holding a slot in this process
+_holding_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at JOB_QUEUE_LIMIT."""
+
+
+class RetryLater(Exception):
+    """Raised by a runner to put its job back in the queue, keeping its slot, for delay seconds."""
+
+    def __init__(self, delay: float):
+        super().__init__(delay)
+        self.delay = delay
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def create_job(job_id: str, user_id, username, image_path: str, original_filename: str,
+               lat: Optional[float], lng: Optional[float]) -> None:
+    with db.transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO report_jobs (id, user_id, username, status, image_path, original_filename, lat, lng)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (job_id, user_id, username, QUEUED, image_path, original_filename, lat, lng),
+        )
+
+
+def delete_job(job_id: str) -> None:
+    with db.transaction() as cur:
+        cur.execute("DELETE FROM report_jobs WHERE id = ?", (job_id,))
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    cur = db.get_db().cursor()
+    cur.execute(
+        """
+        SELECT id, user_id, username, status, image_path, original_filename, lat, lng,
+               result, report_id, error, created_at, updated_at
+        FROM report_jobs WHERE id = ?
+        """,
+        (job_id,),
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    keys = ("id", "user_id", "username", "status", "image_path", "original_filename", "lat", "lng",
+            "result", "report_id", "error", "created_at", "updated_at")
+    job = dict(zip(keys, row))
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def claim(job_id: str) -> bool:
+    """Move a queued job to running; False if another worker already took it."""
+    with db.transaction() as cur:
+        cur.execute(
+            "UPDATE report_jobs SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = ?",
+            (RUNNING, job_id, QUEUED),
+        )
+        return cur.rowcount == 1
+
+
+def requeue(job_id: str) -> None:
+    """Put a running job back in the queue, e.g. while the classifier is unavailable."""
+    with db.transaction() as cur:
+        cur.execute(
+            "UPDATE report_jobs SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (QUEUED, job_id),
+        )
+
+
+def finish(job_id: str, result: Optional[dict] = None, report_id: Optional[int] = None,
+           error: Optional[str] = None) -> None:
+    with db.transaction() as cur:
+        cur.execute(
+            """
+            UPDATE report_jobs SET status = ?, result = ?, report_id = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            (FAILED if error else DONE, json.dumps(result) if result is not None else None, report_id, error, job_id),
+        )
+
+
+def _take_slot(job_id: str) -> None:
+    if not _slots.acquire(blocking=False):
+        raise QueueFull(job_id)
+    with _holding_lock:
+        _holding.add(job_id)
+
+
+def _give_slot(job_id: str) -> None:
+    with _holding_lock:
+        _holding.discard(job_id)
+    _slots.release()
+
+
+def _dispatch(job_id: str, runner: Callable[[str], None]) -> None:
+    """Run a job that already holds a slot on the worker pool."""
+    def _run():
+        try:
+            runner(job_id)
+        except RetryLater as e:
+            requeue(job_id)
+            _schedule(job_id, runner, e.delay)
+            return
+        except BaseException:
+            _give_slot(job_id)
+            raise
+        _give_slot(job_id)
+
+    _executor.submit(_run)
+
+
+_delayed = []  # Heap of (due, seq, job_id, runner); job_id None runs runner() on the scheduler thread
+_delayed_seq = itertools.count()
+_delayed_cond = threading.Condition()
+_scheduler: Optional[threading.Thread] = None
+
+
+def _schedule(job_id: Optional[str], runner: Callable, delay: float) -> None:
+    global _scheduler
+    with _delayed_cond:
+        heapq.heappush(_delayed, (time.monotonic() + delay, next(_delayed_seq), job_id, runner))
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_run_scheduler, name="report-job-scheduler", daemon=True)
+            _scheduler.start()
+        _delayed_cond.notify()
+
+
+def _run_scheduler() -> None:
+    while True:
+        with _delayed_cond:
+            while not _delayed or _delayed[0][0] > time.monotonic():
+                _delayed_cond.wait(_delayed[0][0] - time.monotonic() if _delayed else None)
+            _, _, job_id, runner = heapq.heappop(_delayed)
+        if job_id is None:
+            runner()
+        else:
+            _dispatch(job_id, runner)
+
+
+def submit(job_id: str, runner: Callable[[str], None]) -> None:
+    """Schedule runner(job_id) on the worker pool. Raises QueueFull when saturated."""
+    _take_slot(job_id)
+    _dispatch(job_id, runner)
+
+
+def submit_later(job_id: str, runner: Callable[[str], None], delay: float) -> None:
+    """Schedule runner(job_id) after delay seconds. Raises QueueFull when saturated."""
+    _take_slot(job_id)
+    _schedule(job_id, runner, delay)
+
+
+def resume_pending(runner: Callable[[str], None], retry_delay: float = JOB_RESUME_RETRY_SECONDS) -> int:
+    """Resubmit jobs left queued, or stuck running, by a previous process. Returns how many were scheduled.
+
+    If the queue fills first, the rest are re-scanned after retry_delay
+    seconds, backing off while the queue stays full.
+    """
+    with db.transaction() as cur:
+        # Only stale ones: another live worker process may be running the rest
+        cur.execute(
+            """
+            UPDATE report_jobs SET status = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE status = ? AND updated_at < datetime('now', ?)
+            """,
+            (QUEUED, RUNNING, f"-{JOB_STALE_SECONDS} seconds"),
+        )
+    cur = db.get_db().cursor()
+    cur.execute("SELECT id FROM report_jobs WHERE status = ? ORDER BY created_at", (QUEUED,))
+    scheduled = 0
+    for (job_id,) in cur.fetchall():
+        with _holding_lock:
+            if job_id in _holding:  # Already running or waiting to retry here
+                continue
+        try:
+            submit(job_id, runner)
+        except QueueFull:
+            _schedule(None, lambda: _rescan(runner, retry_delay, backoff=not scheduled), retry_delay)
+            break
+        scheduled += 1
+    return scheduled
+
+
+def _rescan(runner: Callable[[str], None], delay: float, backoff: bool) -> None:
+    """resume_pending on the scheduler thread; an error here must not stop the scheduler."""
+    delay = min(delay * 2, JOB_RESUME_RETRY_MAX_SECONDS) if backoff else JOB_RESUME_RETRY_SECONDS
+    try:
+        resume_pending(runner, delay)
+    except sqlite3.Error:
+        _schedule(None, lambda: _rescan(runner, delay, backoff=True), delay)
@@ -0,0 +1,197 @@
+"""Contributor leaderboards.
+
+The all-time board reads users.xp_total through a descending index. Weekly
+and monthly boards are kept in xp_period_totals, which xp.award() bumps in
+the same transaction as the award, with an index on (period, key, xp) so
+top-N is a bounded index walk. Ranks come from xp_score_counts, a
+histogram of how many users hold each score on each board, kept current by
+triggers on users and xp_period_totals (so xp.award, rebuilds and bulk
+loads all maintain it); a rank sums the counts of the distinct scores
+above, which stays small however many users are ahead. Only earned XP
+counts; spending never moves anyone down.
+"""
+import sqlite3
+from datetime import date, datetime
+from typing import Optional
+
+import periods
+
+ALL = "all"
+WEEK = "week"
+MONTH = "month"
+PERIODS = (ALL, WEEK, MONTH)
+PERIOD_KEYS = {WEEK: periods.week_key, MONTH: periods.month_key}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS xp_period_totals (
+    period TEXT NOT NULL,
+    period_key TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    xp INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, period_key, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_xp_period_totals_rank ON xp_period_totals (period, period_key, xp DESC, user_id);
+CREATE INDEX IF NOT EXISTS idx_users_xp_total ON users (xp_total DESC, id);
+CREATE TABLE IF NOT EXISTS xp_score_counts (
+    period TEXT NOT NULL,
+    period_key TEXT NOT NULL,
+    xp INTEGER NOT NULL,
+    users INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, period_key, xp)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS xp_score_counts_user_insert AFTER INSERT ON users
+WHEN NEW.xp_total > 0
+BEGIN
+    INSERT INTO xp_score_counts (period, period_key, xp, users) VALUES ('all', '', NEW.xp_total, 1)
+    ON CONFLICT(period, period_key, xp) DO UPDATE SET users = users + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS xp_score_counts_user_update AFTER UPDATE OF xp_total ON users
+WHEN OLD.xp_total IS NOT NEW.xp_total
+BEGIN
+    UPDATE xp_score_counts SET users = users - 1 WHERE period = 'all' AND period_key = '' AND xp = OLD.xp_total;
+    INSERT INTO xp_score_counts (period, period_key, xp, users) SELECT 'all', '', NEW.xp_total, 1 WHERE NEW.xp_total > 0
+    ON CONFLICT(period, period_key, xp) DO UPDATE SET users = users + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS xp_score_counts_user_delete AFTER DELETE ON users
+WHEN OLD.xp_total > 0
+BEGIN
+    UPDATE xp_score_counts SET users = users - 1 WHERE period = 'all' AND period_key = '' AND xp = OLD.xp_total;
+END;
+CREATE TRIGGER IF NOT EXISTS xp_score_counts_period_insert AFTER INSERT ON xp_period_totals
+WHEN NEW.xp > 0
+BEGIN
+    INSERT INTO xp_score_counts (period, period_key, xp, users) VALUES (NEW.period, NEW.period_key, NEW.xp, 1)
+    ON CONFLICT(period, period_key, xp) DO UPDATE SET users = users + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS xp_score_counts_period_update AFTER UPDATE OF xp ON xp_period_totals
+WHEN OLD.xp IS NOT NEW.xp
+BEGIN
+    UPDATE xp_score_counts SET users = users - 1
+    WHERE period = OLD.period AND period_key = OLD.period_key AND xp = OLD.xp;
+    INSERT INTO xp_score_counts (period, period_key, xp, users)
+    SELECT NEW.period, NEW.period_key, NEW.xp, 1 WHERE NEW.xp > 0
+    ON CONFLICT(period, period_key, xp) DO UPDATE SET users = users + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS xp_score_counts_period_delete AFTER DELETE ON xp_period_totals
+WHEN OLD.xp > 0
+BEGIN
+    UPDATE xp_score_counts SET users = users - 1
+    WHERE period = OLD.period AND period_key = OLD.period_key AND xp = OLD.xp;
+END;
+"""
+
+
+def period_key(period: str, now: Optional[datetime] = None) -> Optional[str]:
+    if period == ALL:
+        return None
+    return PERIOD_KEYS[period](now or datetime.utcnow())
+
+
+def record(cur: sqlite3.Cursor, user_id, amount: int, now: Optional[datetime] = None) -> None:
+    """Add earned XP to the user's current weekly and monthly totals. Call inside the award's transaction."""
+    if amount <= 0:
+        return
+    now = now or datetime.utcnow()
+    cur.executemany(
+        """
+        INSERT INTO xp_period_totals (period, period_key, user_id, xp) VALUES (?, ?, ?, ?)
+        ON CONFLICT(period, period_key, user_id) DO UPDATE SET xp = xp + excluded.xp
+        """,
+        [(period, period_key(period, now), int(user_id), amount) for period in PERIOD_KEYS],
+    )
+
+
+def rebuild(cur: sqlite3.Cursor, exclude_reasons=()) -> None:
+    """Recompute period totals from the xp_events ledger."""
+    cur.execute("DELETE FROM xp_period_totals")
+    # NOT IN (NULL) would match nothing, so an empty list skips a reason no event has
+    skip = ",".join("?" * len(exclude_reasons)) or "''"
+    # Summed per day in SQL and folded into periods here, where week keys are computed
+    cur.execute(
+        f"""
+        SELECT date(created_at), user_id, SUM(amount) FROM xp_events
+        WHERE amount > 0 AND reason NOT IN ({skip}) AND date(created_at) IS NOT NULL
+        GROUP BY 1, 2
+        """,
+        exclude_reasons,
+    )
+    totals = {}
+    for day, user_id, amount in cur.fetchall():
+        day = date.fromisoformat(day)
+        for period, key in PERIOD_KEYS.items():
+            k = (period, key(day), user_id)
+            totals[k] = totals.get(k, 0) + amount
+    cur.executemany(
+        "INSERT INTO xp_period_totals (period, period_key, user_id, xp) VALUES (?, ?, ?, ?)",
+        ((*k, amount) for k, amount in totals.items()),
+    )
+
+
+def top(conn: sqlite3.Connection, period: str, limit: int, now: Optional[datetime] = None) -> list:
+    """Highest earners, with competition ranking (ties share a rank)."""
+    cur = conn.cursor()
+    if period == ALL:
+        cur.execute(
+            """
+            SELECT id, username, xp_total, level FROM users
+            WHERE xp_total > 0 ORDER BY xp_total DESC, id LIMIT ?
+            """,
+            (limit,),
+        )
+    else:
+        cur.execute(
+            """
+            SELECT t.user_id, u.username, t.xp, u.level FROM xp_period_totals t JOIN users u ON u.id = t.user_id
+            WHERE t.period = ? AND t.period_key = ? ORDER BY t.xp DESC, t.user_id LIMIT ?
+            """,
+            (period, period_key(period, now), limit),
+        )
+    rows = []
+    rank = 0
+    previous = None
+    for position, (_, username, score, level) in enumerate(cur.fetchall(), start=1):
+        if score != previous:
+            rank, previous = position, score
+        rows.append({"rank": rank, "username": username, "xp": score, "level": level})
+    return rows
+
+
+def rank(conn: sqlite3.Connection, period: str, user_id, now: Optional[datetime] = None) -> dict:
+    """The user's score and rank for a period; rank is None until they have earned XP in it."""
+    cur = conn.cursor()
+    if period == ALL:
+        key = ""
+        cur.execute("SELECT COALESCE(xp_total, 0) FROM users WHERE id = ?", (int(user_id),))
+    else:
+        key = period_key(period, now)
+        cur.execute(
+            "SELECT xp FROM xp_period_totals WHERE period = ? AND period_key = ? AND user_id = ?",
+            (period, key, int(user_id)),
+        )
+    row = cur.fetchone()
+    score = row[0] if row else 0
+    # Users ahead, summed per distinct higher score rather than counted row by row
+    cur.execute(
+        "SELECT COALESCE(SUM(users), 0) FROM xp_score_counts WHERE period = ? AND period_key = ? AND xp > ?",
+        (period, key, score),
+    )
+    ahead = cur.fetchone()[0]
+    return {"xp": score, "rank": ahead + 1 if score > 0 else None}
+
+
+def rebuild_score_counts(cur: sqlite3.Cursor) -> None:
+    """Recompute the xp_score_counts histogram from users and xp_period_totals."""
+    cur.execute("DELETE FROM xp_score_counts")
+    cur.execute(
+        """
+        INSERT INTO xp_score_counts (period, period_key, xp, users)
+        SELECT ?, '', xp_total, COUNT(*) FROM users WHERE xp_total > 0 GROUP BY xp_total
+        """,
+        (ALL,),
+    )
+    cur.execute(
+        """
+        INSERT INTO xp_score_counts (period, period_key, xp, users)
+        SELECT period, period_key, xp, COUNT(*) FROM xp_period_totals WHERE xp > 0 GROUP BY period, period_key, xp
+        """
+    )
@@ -0,0 +1,248 @@
+"""Versioned schema migrations.
+
+Each migration runs exactly once per database, in order, inside a single
+write transaction, and is recorded in the schema_version table. migrate()
+is called once at application startup (and by scripts via auth.init_db).
+"""
+import sqlite3
+from typing import Callable, List, Optional, Tuple
+
+import classification_cache
+import clusters
+import cosmetics
+import db
+import jobs
+import leaderboard
+import stats
+import storage
+import xp
+
+
+def _run_script(cur: sqlite3.Cursor, script: str) -> None:
+    """Execute a multi-statement script without executescript's implicit COMMIT."""
+    stmt = ""
+    for line in script.splitlines(keepends=True):
+        stmt += line
+        if sqlite3.complete_statement(stmt):
+            cur.execute(stmt)
+            stmt = ""
+    if stmt.strip():
+        cur.execute(stmt)
+
+
+def _columns(cur: sqlite3.Cursor, table: str) -> set:
+    cur.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cur.fetchall()}
+
+
+def _m001_base_tables(cur: sqlite3.Cursor) -> None:
+    _run_script(cur, """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            username TEXT,
+            species TEXT,
+            invasive INTEGER,
+            summary TEXT,
+            lat REAL,
+            lng REAL,
+            image_filename TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    # Databases created before XP existed lack these columns
+    cols = _columns(cur, "users")
+    add_cols = [
+        ("xp_total", "INTEGER DEFAULT 0"),
+        ("xp_balance", "INTEGER DEFAULT 0"),
+        ("level", "INTEGER DEFAULT 1"),
+        ("unlocked_cosmetics", "TEXT DEFAULT '[]'"),
+        ("active_cosmetic", "TEXT"),
+    ]
+    for name, decl in add_cols:
+        if name not in cols:
+            cur.execute(f"ALTER TABLE users ADD COLUMN {name} {decl}")
+
+
+def _m002_reports_rtree(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS reports_rtree USING rtree(id, min_lat, max_lat, min_lng, max_lng)"
+    )
+    cur.execute(
+        """
+        INSERT OR REPLACE INTO reports_rtree (id, min_lat, max_lat, min_lng, max_lng)
+        SELECT id, lat, lat, lng, lng FROM reports WHERE lat IS NOT NULL AND lng IS NOT NULL
+        """
+    )
+    _run_script(cur, """
+        CREATE TRIGGER IF NOT EXISTS reports_rtree_insert AFTER INSERT ON reports
+        WHEN NEW.lat IS NOT NULL AND NEW.lng IS NOT NULL
+        BEGIN
+            INSERT INTO reports_rtree (id, min_lat, max_lat, min_lng, max_lng)
+            VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lng, NEW.lng);
+        END;
+        CREATE TRIGGER IF NOT EXISTS reports_rtree_update AFTER UPDATE OF lat, lng ON reports
+        BEGIN
+            DELETE FROM reports_rtree WHERE id = OLD.id;
+            INSERT INTO reports_rtree (id, min_lat, max_lat, min_lng, max_lng)
+            SELECT NEW.id, NEW.lat, NEW.lat, NEW.lng, NEW.lng
+            WHERE NEW.lat IS NOT NULL AND NEW.lng IS NOT NULL;
+        END;
+        CREATE TRIGGER IF NOT EXISTS reports_rtree_delete AFTER DELETE ON reports
+        BEGIN
+            DELETE FROM reports_rtree WHERE id = OLD.id;
+        END;
+    """)
+
+
+def _m003_report_cells(cur: sqlite3.Cursor) -> None:
+    _run_script(cur, clusters.SCHEMA)
+    clusters.rebuild(cur.connection)
+
+
+def _m004_feed_indexes(cur: sqlite3.Cursor) -> None:
+    # /api/reports filters on invasive and walks id in order
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reports_invasive_id ON reports (invasive, id)")
+
+
+def _m005_report_jobs(cur: sqlite3.Cursor) -> None:
+    _run_script(cur, jobs.SCHEMA)
+
+
+def _m006_classification_cache(cur: sqlite3.Cursor) -> None:
+    _run_script(cur, classification_cache.SCHEMA)
+
+
+def _m007_xp_ledger(cur: sqlite3.Cursor) -> None:
+    _run_script(cur, xp.SCHEMA)
+    # Carry existing totals over as opening entries so reconcile() reproduces them
+    cur.execute(
+        "INSERT INTO xp_events (user_id, amount, reason) SELECT id, xp_total, ? FROM users WHERE xp_total > 0",
+        (xp.REASON_OPENING,),
+    )
+    cur.execute(
+        """
+        INSERT INTO xp_events (user_id, amount, reason)
+        SELECT id, xp_balance - COALESCE(xp_total, 0), ? FROM users WHERE xp_balance < COALESCE(xp_total, 0)
+        """,
+        (xp.REASON_OPENING,),
+    )
+
+
+def _m008_leaderboard(cur: sqlite3.Cursor) -> None:
+    _run_script(cur, leaderboard.SCHEMA)
+    # Carried-over totals have no date, so they only count toward the all-time board
+    leaderboard.rebuild(cur, exclude_reasons=(xp.REASON_OPENING,))
+
+
+def _m009_user_cosmetics(cur: sqlite3.Cursor) -> None:
+    _run_script(cur, cosmetics.SCHEMA)
+    # users.unlocked_cosmetics (JSON) is no longer read or written after this
+    cur.execute(
+        """
+        INSERT OR IGNORE INTO user_cosmetics (user_id, item_id)
+        SELECT users.id, owned.value FROM users, json_each(users.unlocked_cosmetics) AS owned
+        WHERE json_valid(users.unlocked_cosmetics) AND json_type(users.unlocked_cosmetics) = 'array'
+        """
+    )
+
+
+def _m010_upload_refs(cur: sqlite3.Cursor) -> None:
+    _run_script(cur, storage.SCHEMA)
+    cur.execute(
+        """
+        INSERT INTO upload_refs (name, refs)
+        SELECT image_filename, COUNT(*) FROM reports WHERE image_filename IS NOT NULL GROUP BY image_filename
+        """
+    )
+
+
+def _m011_report_rollups(cur: sqlite3.Cursor) -> None:
+    _run_script(cur, stats.SCHEMA)
+    stats.rebuild(cur.connection)
+
+
+def _m012_iso_weeks(cur: sqlite3.Cursor) -> None:
+    # Week keys moved from strftime's %W to ISO weeks; recompute everything keyed by week
+    leaderboard.rebuild(cur, exclude_reasons=(xp.REASON_OPENING,))
+    stats.rebuild(cur.connection)
+
+
+def _m013_stats_valid_cells(cur: sqlite3.Cursor) -> None:
+    # Reports with out-of-range coordinates used to be counted in bogus cells
+    stats.rebuild(cur.connection)
+
+
+def _m014_xp_score_counts(cur: sqlite3.Cursor) -> None:
+    _run_script(cur, leaderboard.SCHEMA)
+    leaderboard.rebuild_score_counts(cur)
+
+
+def _m015_reports_user_image(cur: sqlite3.Cursor) -> None:
+    # save_reports looks up a user's earlier report of the same stored photo
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reports_user_image ON reports (user_id, image_filename)")
+
+
+def _m016_classification_cache_model(cur: sqlite3.Cursor) -> None:
+    # Entries now belong to a model; old ones may hold stub or mock answers, so start over
+    cur.execute("DROP TABLE IF EXISTS classification_cache")
+    _run_script(cur, classification_cache.SCHEMA)
+
+
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Cursor], None]]] = [
+    (1, _m001_base_tables),
+    (2, _m002_reports_rtree),
+    (3, _m003_report_cells),
+    (4, _m004_feed_indexes),
+    (5, _m005_report_jobs),
+    (6, _m006_classification_cache),
+    (7, _m007_xp_ledger),
+    (8, _m008_leaderboard),
+    (9, _m009_user_cosmetics),
+    (10, _m010_upload_refs),
+    (11, _m011_report_rollups),
+    (12, _m012_iso_weeks),
+    (13, _m013_stats_valid_cells),
+    (14, _m014_xp_score_counts),
+    (15, _m015_reports_user_image),
+    (16, _m016_classification_cache_model),
+]
+
+
+def current_version(cur: sqlite3.Cursor) -> int:
+    cur.execute("SELECT MAX(version) FROM schema_version")
+    return cur.fetchone()[0] or 0
+
+
+def migrate(conn: Optional[sqlite3.Connection] = None) -> int:
+    """Apply pending migrations and return the resulting schema version."""
+    own = conn is None
+    conn = conn or db.connect()
+    try:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, applied_at TEXT DEFAULT CURRENT_TIMESTAMP)"
+        )
+        # One writer at a time, so concurrently starting workers don't race
+        with db.transaction(conn, immediate=True) as cur:
+            version = current_version(cur)
+            for target, step in MIGRATIONS:
+                if target <= version:
+                    continue
+                step(cur)
+                cur.execute("INSERT INTO schema_version (version) VALUES (?)", (target,))
+                version = target
+        return version
+    finally:
+        if own:
+            conn.close()
+
+
+if __name__ == "__main__":
+    print(f"Schema at version {migrate()} ({db.db_path()})")
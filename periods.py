@@ -0,0 +1,22 @@
+"""Calendar period keys shared by the leaderboards and report statistics.
+
+Weeks are ISO 8601 weeks: they start on Monday and belong to the ISO year
+of their Thursday, so a week spanning New Year keeps a single key. SQLite's
+strftime has no portable ISO week, so week keys are only ever computed
+here, never in SQL.
+"""
+from datetime import date
+
+
+def day_key(day: date) -> str:
+    return day.strftime("%Y-%m-%d")
+
+
+def week_key(day: date) -> str:
+    """ISO year-week, e.g. "2026-W01" for every day from 2025-12-29 to 2026-01-04."""
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def month_key(day: date) -> str:
+    return day.strftime("%Y-%m")
@@ -0,0 +1,154 @@
+"""Build fingerprinted, precompressed static assets into static/dist.
+
+Every file under static/ (except dist/ itself) is copied to
+static/dist/<dir>/<name>.<hash>.<ext>. Text assets get .gz siblings, plus
+.br ones when the brotli package is installed. The tree sprites are packed
+into one horizontal atlas. static/dist/manifest.json maps source paths to
+their built names and describes the atlas frames; assets.asset_url() reads
+it so templates link the fingerprinted files, which are then served with
+immutable cache headers.
+
+Builds are additive: new files are written beside the old ones and the
+manifest is swapped in last, so servers still holding the previous manifest
+keep finding its files. Files a build no longer references are recorded as
+retired in the manifest and deleted by a later build once they have been
+retired for RETIRED_GRACE_SECONDS.
+
+    python scripts/build_assets.py
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import brotli
+except Exception:  # Brotli is optional; only gzip variants are written without it
+    brotli = None
+
+try:
+    from PIL import Image
+except Exception:  # Pillow is optional; sprites are then fingerprinted individually
+    Image = None
+
+# Ensure project root on path
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+import assets  # noqa
+
+STATIC = ROOT / 'static'
+HASH_LEN = 10
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+MIN_COMPRESS_BYTES = 512  # Smaller files aren't worth a second request path
+SPRITES = [f'assets/tree/sprite_{i}.png' for i in range(5)]
+ATLAS_NAME = 'tree'
+ATLAS_PATH = 'assets/tree/atlas.png'
+RETIRED_GRACE_SECONDS = 7 * 24 * 3600  # Outlasts servers and cached pages still naming an older build
+
+
+def fingerprint(rel: str, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LEN]
+    path = Path(rel)
+    return str(path.with_name(f'{path.stem}.{digest}{path.suffix}').as_posix())
+
+
+def write(out_dir: Path, rel: str, data: bytes) -> str:
+    """Write one fingerprinted file and its compressed variants; returns the built path."""
+    built = fingerprint(rel, data)
+    target = out_dir / built
+    if target.exists():  # Same name, same content: already built
+        return built
+    target.parent.mkdir(parents=True, exist_ok=True)
+    target.write_bytes(data)
+    if Path(rel).suffix in COMPRESSIBLE and len(data) >= MIN_COMPRESS_BYTES:
+        gz = gzip.compress(data, compresslevel=9, mtime=0)  # mtime=0 keeps builds reproducible
+        if len(gz) < len(data):
+            target.with_name(target.name + '.gz').write_bytes(gz)
+        if brotli is not None:
+            br = brotli.compress(data, quality=11)
+            if len(br) < len(data):
+                target.with_name(target.name + '.br').write_bytes(br)
+    return built
+
+
+def pack_atlas(paths: list) -> tuple:
+    """Lay sprites out left to right; returns (png bytes, width, height, frames)."""
+    images = [Image.open(STATIC / p).convert('RGBA') for p in paths]
+    width = sum(img.width for img in images)
+    height = max(img.height for img in images)
+    atlas = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    frames = {}
+    x = 0
+    for rel, img in zip(paths, images):
+        atlas.paste(img, (x, 0))
+        frames[Path(rel).name] = {"x": x, "y": 0, "w": img.width, "h": img.height}
+        x += img.width
+    out = io.BytesIO()
+    atlas.save(out, 'PNG', optimize=True)
+    return out.getvalue(), width, height, frames
+
+
+def _write_manifest(out_dir: Path, manifest: dict) -> None:
+    """Replace the manifest in one rename, so readers see the old or the new one, never a partial file."""
+    fd, tmp = tempfile.mkstemp(dir=out_dir, prefix='.manifest-')
+    try:
+        with os.fdopen(fd, 'w') as out:
+            out.write(json.dumps(manifest, indent=2, sort_keys=True))
+        os.replace(tmp, out_dir / assets.MANIFEST_NAME)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _retire(out_dir: Path, manifest: dict, previous: dict, now: float) -> None:
+    """Record files the new manifest doesn't use, deleting those retired for RETIRED_GRACE_SECONDS."""
+    built = list(manifest["files"].values()) + [atlas["file"] for atlas in manifest["sprites"].values()]
+    live = {name + suffix for name in built for suffix in ('', '.gz', '.br')}
+    retired = {}
+    for path in out_dir.rglob('*'):
+        rel = path.relative_to(out_dir).as_posix()
+        if not path.is_file() or rel in live or rel == assets.MANIFEST_NAME or path.name.startswith('.'):
+            continue
+        since = previous.get(rel, now)
+        if now - since >= RETIRED_GRACE_SECONDS:
+            path.unlink()
+        else:
+            retired[rel] = since
+    manifest["retired"] = retired
+
+
+def build(out_dir: Path = assets.DIST_DIR) -> dict:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        previous = json.loads((out_dir / assets.MANIFEST_NAME).read_text()).get("retired", {})
+    except (OSError, ValueError):
+        previous = {}
+    manifest = {"files": {}, "sprites": {}}
+    sources = sorted(p for p in STATIC.rglob('*') if p.is_file() and out_dir not in p.parents)
+    for path in sources:
+        rel = path.relative_to(STATIC).as_posix()
+        manifest["files"][rel] = write(out_dir, rel, path.read_bytes())
+    if Image is not None and all((STATIC / p).exists() for p in SPRITES):
+        data, width, height, frames = pack_atlas(SPRITES)
+        manifest["sprites"][ATLAS_NAME] = {
+            "file": write(out_dir, ATLAS_PATH, data),
+            "width": width,
+            "height": height,
+            "frames": frames,
+        }
+    _retire(out_dir, manifest, previous, time.time())
+    _write_manifest(out_dir, manifest)
+    return manifest
+
+
+if __name__ == '__main__':
+    result = build()
+    atlas = result["sprites"].get(ATLAS_NAME)
+    print(f"Built {len(result['files'])} assets into {assets.DIST_DIR}"
+          + (f" (+ {len(atlas['frames'])}-frame atlas)" if atlas else "")
+          + (f"; keeping {len(result['retired'])} retired files" if result['retired'] else ""))
@@ -0,0 +1,86 @@
+"""Local stand-in for the classification API.
+
+Answers POST /classify with {"image": <data URL>, "lat", "lng"} after a
+simulated delay, failing a configurable fraction of requests with 503 so
+retries and the circuit breaker can be exercised. Point the app at it with
+
+    CLASSIFIER_BACKEND=mock CLASSIFIER_MOCK_URL=http://127.0.0.1:8081/classify
+"""
+import json
+import random
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Ensure project root on path
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+import classifier  # noqa
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+    latency_ms = 0.0
+    jitter_ms = 0.0
+    error_rate = 0.0
+    invasive_rate = classifier.STUB_INVASIVE_RATE
+
+    def _reply(self, code: int, payload: dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        if self.path != "/classify":
+            return self._reply(404, {"detail": "not found"})
+        try:
+            image = json.loads(raw)["image"]
+        except Exception:
+            return self._reply(400, {"detail": "expected JSON with an image field"})
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if random.random() < self.error_rate:
+            return self._reply(503, {"detail": "simulated upstream failure"})
+        self._reply(200, classifier.stub_result(image.encode("ascii"), self.invasive_rate))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> None:
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    print(f"Mock classifier on http://{host}:{port}/classify")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a local mock of the classification API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', '-p', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=200.0, help='Mean response delay')
+    parser.add_argument('--jitter-ms', type=float, default=50.0, help='Uniform +/- spread around the delay')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    parser.add_argument('--invasive-rate', type=float, default=classifier.STUB_INVASIVE_RATE)
+    parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible error injection')
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    Handler.latency_ms = args.latency_ms
+    Handler.jitter_ms = args.jitter_ms
+    Handler.error_rate = args.error_rate
+    Handler.invasive_rate = args.invasive_rate
+    serve(args.port, args.host)
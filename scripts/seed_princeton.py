@@ -1,29 +1,57 @@
+"""Seed fake invasive-species reports.
+
+By default a handful of reports are scattered around Princeton. --bulk
+generates production-scale datasets instead: reports are spread over
+several weighted metro centers with Gaussian falloff, attributed to
+generated users with a long-tailed activity distribution (whose XP and
+level match their reports), and inserted with chunked executemany calls
+in a single transaction. A fixed --seed makes every dataset reproducible.
+
+    python scripts/seed_princeton.py --bulk --count 1000000 --users 5000
+"""
 import os
 import random
 import sqlite3
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
-import base64
-import json
+import io
 import sys
+from contextlib import contextmanager
+
+from PIL import Image, ImageDraw
 
 # Ensure project root on path
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.append(str(ROOT))
 import auth as auth_module  # noqa
+import clusters  # noqa
+import db  # noqa
+import leaderboard  # noqa
+import stats  # noqa
+import storage  # noqa
+import xp  # noqa
 
 DB_PATH = auth_module._db_path()
 
-GREEN_DOT = (
-    'iVBORw0KGgoAAAANSUhEUgAAABgAAAAYCAYAAADgdz34AAAAGXRFW\nHRSYXcgcHJvZmlsZSB0eXBlIGV4aWYAAHja7ZZRCsIwEIXv0p0i7lV2\nY1pO5C4o6XHjB6l6GJJuCk0F6Gtw3Q0tEPpG4m3m+o2l1mQW8C0sS3kB\n5iQSYX2rY0p4t4p9r4dQ2m0iE+FJ0V7iCk4KQ6YmlO5f3wRk4eLw8H3Q\nG0OQ4Uo7u1jJf8I7x3vHkO1Y5p2XJ5nY3Cz6Gv4S6HcRr7N2G6uY8z5J\n7wE2UjH0bqLZ8hK2h0cV6xk1IYq4bqzvQyG8u0iS2dC0XyQdJ0vHh0jC\nG7uHjX0xI9cM+v5o8YtG4B3sTDK8sN8r6mXW5sGxqCqf6gWk5QWf7hJt\n9fU7c8mZy1kAAAAJcEhZcwAACxMAAAsTAQCanBgAAAANSURBVEhL7c0x\nAQAgEMKg+T8zIY0X4bA5pJpEb3wqv0IAA1tTj6wAAAABJRU5ErkJggg=='
-)
-RED_DOT = (
-    'iVBORw0KGgoAAAANSUhEUgAAABgAAAAYCAYAAADgdz34AAAAGXRFW\nHRSYXcgcHJvZmlsZSB0eXBlIGV4aWYAAHja7ZZRCsIwEIXv0p0i7lV2\nY1pO5C4o6XHjB6l6GJJuCk0F6Gtw3Q0tEPpG4m3m+o2l1mQW8C0sS3kB\n5iQSYX2rY0p4t4p9r4dQ2m0iE+FJ0V7iCk4KQ6YmlO5f3wRk4eLw8H3Q\nG0OQ4Uo7u1jJf8I7x3vHkO1Y5p2XJ5nY3Cz6Gv4S6HcRr7N2G6uY8z5J\n7wE2UjH0bqLZ8hK2h0cV6xk1IYq4bqzvQyG8u0iS2dC0XyQdJ0vHh0jC\nG7uHjX0xI9cM+v5o8YtG4B3sTDK8sN8r6mXW5sGxqCqf6gWk5QWf7hJt\n9fU7c8mZy1kAAAAJcEhZcwAACxMAAAsTAQCanBgAAAANSURBVEhL7c0x\nAQAgEMKg+T8zIY0X4bA5pJpEb3wqv0IAA1tTj6wAAAABJRU5ErkJggg=='
-)
+DOT_SIZE = 24  # Placeholder image edge in pixels
+DOT_COLORS = {'green': (46, 160, 67), 'red': (215, 58, 73)}
+
+
+def _dot_png(rgb: tuple) -> io.BytesIO:
+    img = Image.new('RGBA', (DOT_SIZE, DOT_SIZE), (0, 0, 0, 0))
+    ImageDraw.Draw(img).ellipse((2, 2, DOT_SIZE - 3, DOT_SIZE - 3), fill=rgb + (255,))
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf
+
+
+def seed_images() -> dict:
+    """Store a dot per color in uploads/ like a real upload and return the stored names by color."""
+    # Resolved like app.py does; importing app would run migrations and resume jobs
+    folder = Path(os.getenv('INVASISEE_UPLOAD_FOLDER') or ROOT / 'uploads')
+    return {color: storage.store(_dot_png(rgb), folder) for color, rgb in DOT_COLORS.items()}
 
-def tiny_data_url(color: str) -> str:
-    # both strings are same PNG payload here for brevity
-    b64 = GREEN_DOT if color == 'green' else RED_DOT
-    return 'data:image/png;base64,' + b64.replace('\n', '')
 
 SPECIES = [
     ("Kudzu", True),
@@ -37,58 +65,182 @@ SPECIES = [
 CENTER_LAT = 40.343094
 CENTER_LNG = -74.651448
 
+# (name, lat, lng, weight, spread in degrees); weights roughly follow population
+CENTERS = [
+    ("Princeton", CENTER_LAT, CENTER_LNG, 1.0, 0.03),
+    ("New York", 40.7128, -74.0060, 8.0, 0.12),
+    ("Philadelphia", 39.9526, -75.1652, 4.0, 0.10),
+    ("Trenton", 40.2171, -74.7429, 1.0, 0.04),
+    ("New Brunswick", 40.4862, -74.4518, 1.0, 0.04),
+    ("Boston", 42.3601, -71.0589, 3.0, 0.10),
+    ("Washington", 38.9072, -77.0369, 4.0, 0.10),
+]
+BACKGROUND_SHARE = 0.05  # Fraction of reports spread uniformly over the whole region
+CHUNK_SIZE = 50_000  # Rows per executemany batch
+DAYS_BACK = 365  # Report timestamps span this many days
+BULK_CACHE_KIB = 256 * 1024  # Page cache while bulk loading; the R*Tree build is cache-bound
+
 
 def jitter(val: float, radius: float = 0.01) -> float:
     return val + random.uniform(-radius, radius)
 
 
-def ensure_reports_table(conn: sqlite3.Connection):
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            username TEXT,
-            species TEXT,
-            invasive INTEGER,
-            summary TEXT,
-            lat REAL,
-            lng REAL,
-            image_filename TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
+def _insert_reports(cur: sqlite3.Cursor, rows) -> int:
+    """executemany rows in CHUNK_SIZE batches; returns rows inserted. The caller owns the transaction."""
+    total = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            total += _flush(cur, chunk)
+            chunk = []
+    if chunk:
+        total += _flush(cur, chunk)
+    return total
+
+
+def _flush(cur: sqlite3.Cursor, chunk: list) -> int:
+    cur.executemany(
         """
+        INSERT INTO reports (user_id, username, species, invasive, summary, lat, lng, image_filename, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        chunk,
     )
-    conn.commit()
+    return len(chunk)
 
 
 def seed(n: int = 15):
     auth_module.init_db()
-    conn = sqlite3.connect(DB_PATH)
-    ensure_reports_table(conn)
-    cur = conn.cursor()
+    images = seed_images()
+    conn = db.connect(DB_PATH)
+    created_at = datetime.utcnow().isoformat()
+    rows = []
     for _ in range(n):
         sp, inv = random.choice(SPECIES)
-        lat = jitter(CENTER_LAT, 0.01)
-        lng = jitter(CENTER_LNG, 0.01)
-        img = tiny_data_url('green' if inv else 'red')
-        summary = f"Seeded report near Princeton for {sp}."
+        rows.append((
+            None, 'seed', sp, 1 if inv else 0, f"Seeded report near Princeton for {sp}.",
+            jitter(CENTER_LAT, 0.01), jitter(CENTER_LNG, 0.01), images['green' if inv else 'red'], created_at,
+        ))
+    with db.transaction(conn) as cur:
+        _insert_reports(cur, rows)
+    with db.transaction(conn):
+        clusters.rebuild(conn)
+        stats.rebuild(conn)
+    conn.close()
+    print(f"Seeded {n} reports near Princeton into {DB_PATH}")
+
+
+@contextmanager
+def _rtree_deferred(conn: sqlite3.Connection):
+    """Index reports inserted inside the block in one pass instead of via the per-row trigger.
+
+    Yields a cursor. Dropping the trigger, the block's inserts and recreating
+    the trigger share one transaction, so a failed or killed run rolls back
+    to the intact trigger rather than leaving new reports unindexed.
+    """
+    with db.transaction(conn, immediate=True) as cur:
+        cur.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'reports_rtree_insert'")
+        row = cur.fetchone()
+        if row is None:
+            yield cur
+            return
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM reports")
+        start_id = cur.fetchone()[0]
+        cur.execute("DROP TRIGGER reports_rtree_insert")
+        yield cur
+        cur.execute(
+            """
+            INSERT INTO reports_rtree (id, min_lat, max_lat, min_lng, max_lng)
+            SELECT id, lat, lat, lng, lng FROM reports WHERE id > ? AND lat IS NOT NULL AND lng IS NOT NULL
+            """,
+            (start_id,),
+        )
+        cur.execute(row[0])
+
+
+def _generate_users(conn: sqlite3.Connection, count: int, rng: random.Random) -> list:
+    """Create seed users (or reuse them from an earlier run); returns [(id, username, activity weight)]."""
+    hashed = auth_module.PWD_CONTEXT.hash('seed-password')  # Shared so hashing doesn't dominate
+    names = [f'seed_user_{i}' for i in range(count)]
+    with db.transaction(conn) as cur:
+        cur.executemany("INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)", ((u, hashed) for u in names))
+    cur = conn.cursor()
+    cur.execute("SELECT id, username FROM users WHERE username LIKE 'seed\\_user\\_%' ESCAPE '\\' ORDER BY id")
+    # Pareto weights: a few very active reporters, a long tail of occasional ones
+    return [(str(uid), name, rng.paretovariate(1.2)) for uid, name in cur.fetchall()[:count]]
+
+
+def _bulk_rows(n: int, users: list, images: dict, rng: random.Random):
+    weights = [c[3] for c in CENTERS]
+    lat_min = min(c[1] for c in CENTERS) - 1
+    lat_max = max(c[1] for c in CENTERS) + 1
+    lng_min = min(c[2] for c in CENTERS) - 1
+    lng_max = max(c[2] for c in CENTERS) + 1
+    centers = rng.choices(CENTERS, weights=weights, k=n)
+    authors = rng.choices(users, weights=[u[2] for u in users], k=n)
+    now = datetime.utcnow()
+    for i in range(n):
+        if rng.random() < BACKGROUND_SHARE:
+            lat, lng, place = rng.uniform(lat_min, lat_max), rng.uniform(lng_min, lng_max), 'the region'
+        else:
+            place, clat, clng, _, spread = centers[i]
+            lat, lng = rng.gauss(clat, spread), rng.gauss(clng, spread)
+        sp, inv = rng.choice(SPECIES)
+        uid, username, _ = authors[i]
+        created = now - timedelta(seconds=rng.uniform(0, DAYS_BACK * 86400))
+        yield (
+            uid, username, sp, 1 if inv else 0, f"Seeded report near {place} for {sp}.",
+            lat, lng, images['green' if inv else 'red'], created.isoformat(),
+        )
+
+
+def _award_seed_xp(conn: sqlite3.Connection, after_id: int) -> None:
+    """Write ledger entries for reports after after_id and derive users' totals from the ledger."""
+    with db.transaction(conn) as cur:
         cur.execute(
             """
-            INSERT INTO reports (user_id, username, species, invasive, summary, lat, lng, image_filename, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+            INSERT INTO xp_events (user_id, amount, reason, report_id, created_at)
+            SELECT CAST(user_id AS INTEGER), ?, ?, id, created_at FROM reports
+            WHERE id > ? AND invasive = 1 AND user_id IS NOT NULL
             """,
-            (None, 'seed', sp, 1 if inv else 0, summary, lat, lng, img),
+            (xp.XP_PER_INVASIVE, xp.REASON_REPORT, after_id),
         )
-    conn.commit()
+        xp.reconcile(cur)
+        leaderboard.rebuild(cur, exclude_reasons=(xp.REASON_OPENING,))
+
+
+def bulk_seed(n: int, users: int = 1000, seed_value: int = 42):
+    """Generate n reports across CENTERS from `users` generated accounts."""
+    auth_module.init_db()
+    rng = random.Random(seed_value)
+    images = seed_images()
+    conn = db.connect(DB_PATH)
+    conn.execute(f"PRAGMA cache_size=-{BULK_CACHE_KIB}")
+    started = time.perf_counter()
+    people = _generate_users(conn, users, rng)
+    after_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM reports").fetchone()[0]
+    with _rtree_deferred(conn) as cur:
+        inserted = _insert_reports(cur, _bulk_rows(n, people, images, rng))
+    _award_seed_xp(conn, after_id)
+    with db.transaction(conn):
+        clusters.rebuild(conn)
+        stats.rebuild(conn)
+    conn.execute("ANALYZE")
     conn.close()
-    print(f"Seeded {n} reports near Princeton into {DB_PATH}")
+    print(f"Seeded {inserted} reports from {len(people)} users into {DB_PATH} "
+          f"in {time.perf_counter() - started:.1f}s")
 
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(description='Seed fake reports near Princeton into the database.')
     parser.add_argument('--count', '-c', type=int, default=15, help='Number of reports to insert')
+    parser.add_argument('--bulk', action='store_true', help='Multi-center dataset with generated users')
+    parser.add_argument('--users', '-u', type=int, default=1000, help='Generated users (--bulk only)')
+    parser.add_argument('--seed', type=int, default=42, help='RNG seed (--bulk only)')
     args = parser.parse_args()
-    seed(args.count)
+    if args.bulk:
+        bulk_seed(args.count, args.users, args.seed)
+    else:
+        seed(args.count)
@@ -0,0 +1,167 @@
+"""Materialized report statistics for /api/stats.
+
+Reports are rolled up by (grain, period, cell, species), where grain is a
+day or an ISO week (keys from periods.py) and the cell is a slippy-map tile
+at STATS_CELL_ZOOM. Per-species
+totals are kept separately. record() updates both in the transaction that
+inserts the report, so a query reads rollup rows whose number depends on
+the days, cells and species asked about, never on how many reports exist.
+
+    python stats.py    # rebuild the rollups from the reports table
+"""
+import os
+import sqlite3
+from datetime import date, datetime
+from typing import Optional, Tuple
+
+import clusters
+import periods
+
+STATS_CELL_ZOOM = int(os.getenv("STATS_CELL_ZOOM", "10"))  # ~30 km tiles at mid latitudes
+DAY = "day"
+WEEK = "week"
+GRAIN_KEYS = {DAY: periods.day_key, WEEK: periods.week_key}
+NO_CELL = -1  # x and y for reports without coordinates
+GROUPS = ("species", DAY, WEEK, "cell")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_rollups (
+    grain TEXT NOT NULL,
+    period_key TEXT NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    species TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (grain, period_key, x, y, species)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS report_species_totals (
+    species TEXT PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+"""
+
+
+def _cell(lat: Optional[float], lng: Optional[float]) -> Tuple[int, int]:
+    # Same bounds the upload paths accept (NaN fails every comparison); rows stored
+    # before that check, with coordinates no bbox can select, get no cell
+    if lat is None or lng is None or not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+        return NO_CELL, NO_CELL
+    return clusters.tile_xy(lat, lng, STATS_CELL_ZOOM)
+
+
+def record(cur: sqlite3.Cursor, lat: Optional[float], lng: Optional[float], species: Optional[str],
+           created_at: str) -> None:
+    """Count one report. Call inside the insert's transaction."""
+    species = species or "Unknown"
+    x, y = _cell(lat, lng)
+    when = datetime.fromisoformat(created_at)
+    cur.executemany(
+        """
+        INSERT INTO report_rollups (grain, period_key, x, y, species, count) VALUES (?, ?, ?, ?, ?, 1)
+        ON CONFLICT(grain, period_key, x, y, species) DO UPDATE SET count = count + 1
+        """,
+        [(grain, key(when), x, y, species) for grain, key in GRAIN_KEYS.items()],
+    )
+    cur.execute(
+        """
+        INSERT INTO report_species_totals (species, count) VALUES (?, 1)
+        ON CONFLICT(species) DO UPDATE SET count = count + 1
+        """,
+        (species,),
+    )
+
+
+def rebuild(conn: sqlite3.Connection) -> int:
+    """Recompute all rollups from the reports table; the caller commits. Returns reports counted."""
+    rollups = {}
+    totals = {}
+    total = 0
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT lat, lng, COALESCE(species, 'Unknown'), date(created_at)
+        FROM reports WHERE invasive = 1 AND date(created_at) IS NOT NULL
+        """
+    )
+    for lat, lng, species, day in cur:
+        total += 1
+        cell = _cell(lat, lng)
+        day = date.fromisoformat(day)
+        for grain, period in GRAIN_KEYS.items():
+            key = (grain, period(day), *cell, species)
+            rollups[key] = rollups.get(key, 0) + 1
+        totals[species] = totals.get(species, 0) + 1
+    cur.execute("DELETE FROM report_rollups")
+    cur.execute("DELETE FROM report_species_totals")
+    cur.executemany(
+        "INSERT INTO report_rollups (grain, period_key, x, y, species, count) VALUES (?, ?, ?, ?, ?, ?)",
+        ((*key, count) for key, count in rollups.items()),
+    )
+    cur.executemany("INSERT INTO report_species_totals (species, count) VALUES (?, ?)", totals.items())
+    return total
+
+
+def query(conn: sqlite3.Connection, group: str, species: Optional[str] = None,
+          bbox: Optional[Tuple[float, float, float, float]] = None,
+          start: Optional[str] = None, end: Optional[str] = None) -> list:
+    """Report counts grouped by "species", "day", "week" or "cell".
+
+    bbox selects the STATS_CELL_ZOOM cells it touches, so it is as precise
+    as the grid. start/end are inclusive YYYY-MM-DD dates; with them the
+    day rollup is read so the range is exact, otherwise the coarser week
+    rollup.
+    """
+    cur = conn.cursor()
+    if group == "species" and not (species or bbox or start or end):
+        cur.execute("SELECT species, count FROM report_species_totals WHERE count > 0 ORDER BY count DESC, species")
+        return [{"species": name, "count": count} for name, count in cur.fetchall()]
+    grain = DAY if group == DAY or start or end else WEEK
+    where = ["grain = ?"]
+    params = [grain]
+    if start:
+        where.append("period_key >= ?")
+        params.append(start)
+    if end:
+        where.append("period_key <= ?")
+        params.append(end)
+    if species:
+        where.append("species = ?")
+        params.append(species)
+    if bbox:
+        ranges = clusters.tile_ranges(bbox, STATS_CELL_ZOOM)
+        where.append("(" + " OR ".join("(x BETWEEN ? AND ? AND y BETWEEN ? AND ?)" for _ in ranges) + ")")
+        for r in ranges:
+            params.extend(r)
+    conditions = " AND ".join(where)
+    if group in (DAY, WEEK):
+        cur.execute(f"SELECT period_key, SUM(count) FROM report_rollups WHERE {conditions} GROUP BY 1 ORDER BY 1",
+                    params)
+        rows = cur.fetchall()
+        if group == WEEK and grain == DAY:
+            # Date-bounded weekly view: fold the days in range into their (ascending) weeks
+            weeks = {}
+            for day, count in rows:
+                week = periods.week_key(date.fromisoformat(day))
+                weeks[week] = weeks.get(week, 0) + count
+            rows = weeks.items()
+        return [{group: period, "count": count} for period, count in rows]
+    if group == "species":
+        cur.execute(
+            f"SELECT species, SUM(count) AS n FROM report_rollups WHERE {conditions} GROUP BY species "
+            "ORDER BY n DESC, species",
+            params,
+        )
+        return [{"species": name, "count": count} for name, count in cur.fetchall()]
+    cur.execute(
+        f"SELECT x, y, SUM(count) AS n FROM report_rollups WHERE {conditions} AND x != ? "
+        "GROUP BY x, y ORDER BY n DESC, x, y",
+        (*params, NO_CELL),
+    )
+    return [{"x": x, "y": y, **clusters.tile_center(x, y, STATS_CELL_ZOOM), "count": count}
+            for x, y, count in cur.fetchall()]
+
+
+if __name__ == "__main__":
+    import db
+    with db.transaction(db.connect(), immediate=True) as cur:
+        print(f"Rebuilt statistics from {rebuild(cur.connection)} reports")
@@ -0,0 +1,183 @@
+"""Content-addressed upload store.
+
+Report images are stored once per distinct content as
+<root>/<h[0:2]>/<h[2:4]>/<sha256>.<ext>, so identical photos share a file
+and no directory grows beyond a few dozen entries even at millions of
+uploads. upload_refs counts the reports pointing at each file; triggers on
+reports keep it current, and gc() deletes files nobody references.
+Because a name never changes content, it doubles as a strong ETag.
+
+Display derivatives (see imaging.DERIVATIVES) are rendered on first request
+and cached under <root>/derived/<size>/<name>.jpg.
+"""
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+import db
+import imaging
+
+COPY_CHUNK_SIZE = 64 * 1024
+GC_GRACE_SECONDS = 3600  # Unreferenced files younger than this may belong to a save still in flight
+EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/heic": ".heic",
+}
+_NAME_RE = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.[a-z]+$")
+
+DERIVED_DIR = "derived"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_refs (
+    name TEXT PRIMARY KEY,
+    refs INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS upload_refs_insert AFTER INSERT ON reports
+WHEN NEW.image_filename IS NOT NULL
+BEGIN
+    INSERT INTO upload_refs (name, refs) VALUES (NEW.image_filename, 1)
+    ON CONFLICT(name) DO UPDATE SET refs = refs + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS upload_refs_delete AFTER DELETE ON reports
+WHEN OLD.image_filename IS NOT NULL
+BEGIN
+    UPDATE upload_refs SET refs = refs - 1 WHERE name = OLD.image_filename;
+END;
+CREATE TRIGGER IF NOT EXISTS upload_refs_update AFTER UPDATE OF image_filename ON reports
+WHEN OLD.image_filename IS NOT NEW.image_filename
+BEGIN
+    UPDATE upload_refs SET refs = refs - 1 WHERE name = OLD.image_filename;
+    INSERT INTO upload_refs (name, refs) SELECT NEW.image_filename, 1 WHERE NEW.image_filename IS NOT NULL
+    ON CONFLICT(name) DO UPDATE SET refs = refs + 1;
+END;
+"""
+
+
+def content_name(digest: str, mime: Optional[str]) -> str:
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{EXTENSIONS.get(mime, '.bin')}"
+
+
+def digest_of(name: str) -> Optional[str]:
+    """The SHA-256 a stored name was derived from, or None for legacy flat names."""
+    m = _NAME_RE.match(name)
+    return m.group(1) if m else None
+
+
+def store(image: BinaryIO, root: Path, digest: Optional[str] = None) -> str:
+    """Store an upload under its content address (once) and return the relative name.
+
+    Pass digest when the SHA-256 of the stream is already known.
+    """
+    image.seek(0)
+    mime = imaging.sniff_mime(image.read(16))
+    if digest is None:
+        image.seek(0)
+        digest = hashlib.file_digest(image, "sha256").hexdigest()
+    name = content_name(digest, mime)
+    target = Path(root) / name
+    if target.exists():
+        return name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # Write beside the target and rename, so readers never see a partial file.
+    # Streamed rather than via _write_atomic so the upload is never held in memory.
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=".upload-")
+    try:
+        image.seek(0)
+        with os.fdopen(fd, "wb") as out:
+            shutil.copyfileobj(image, out, COPY_CHUNK_SIZE)
+        os.replace(tmp, target)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return name
+
+
+def _write_atomic(target: Path, data: bytes) -> None:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.replace(tmp, target)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def derivative_name(name: str, size: str) -> str:
+    return f"{DERIVED_DIR}/{size}/{name}.jpg"
+
+
+def derivative(root: Path, name: str, size: str) -> Optional[str]:
+    """Relative name of a cached display derivative, rendering it on first use.
+
+    Returns None when the original is missing or can't be decoded (e.g. no
+    Pillow); callers then fall back to the original.
+    """
+    root = Path(root)
+    rel = derivative_name(name, size)
+    target = root / rel
+    if target.is_file():
+        return rel
+    source = root / name
+    if not source.resolve().is_relative_to(root.resolve()) or not source.is_file():
+        return None
+    with open(source, "rb") as f:
+        data = imaging.render_derivative(f, size)
+    if data is None:
+        return None
+    # Concurrent first requests may both render; the rename makes that harmless
+    _write_atomic(target, data)
+    return rel
+
+
+def _unlink_with_derivatives(root: Path, name: str) -> None:
+    (root / name).unlink()
+    for size in imaging.DERIVATIVES:
+        (root / derivative_name(name, size)).unlink(missing_ok=True)
+
+
+def gc(conn: sqlite3.Connection, root: Path, grace_seconds: int = GC_GRACE_SECONDS) -> int:
+    """Delete stored files no report references any more. Returns files removed.
+
+    Also sweeps content-addressed files that never got a reference (the
+    report transaction rolled back after store()), once they are older than
+    grace_seconds.
+    """
+    root = Path(root)
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM upload_refs WHERE refs <= 0")
+    removed = 0
+    for (name,) in cur.fetchall():
+        # Re-check under the write lock: a new report may have claimed it meanwhile
+        with db.transaction(conn, immediate=True) as tx:
+            tx.execute("DELETE FROM upload_refs WHERE name = ? AND refs <= 0", (name,))
+            gone = tx.rowcount
+            path = root / name
+            if gone and path.resolve().is_relative_to(root.resolve()) and path.is_file():
+                _unlink_with_derivatives(root, name)
+                removed += 1
+    cutoff = time.time() - grace_seconds
+    for path in root.glob("[0-9a-f][0-9a-f]/[0-9a-f][0-9a-f]/*"):
+        name = path.relative_to(root).as_posix()
+        if not digest_of(name) or path.stat().st_mtime > cutoff:
+            continue
+        cur.execute("SELECT 1 FROM upload_refs WHERE name = ?", (name,))
+        if cur.fetchone() is None:
+            _unlink_with_derivatives(root, name)
+            removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    root = Path(os.getenv("INVASISEE_UPLOAD_FOLDER") or Path(__file__).resolve().parent / "uploads")
+    print(f"Removed {gc(db.connect(), root)} unreferenced uploads from {root}")
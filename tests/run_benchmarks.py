@@ -0,0 +1,429 @@
+"""Benchmarks for the hot API endpoints.
+
+Seeds a scratch database with a fixed RNG at one or more scales, then
+drives /api/reports, /api/profile, /api/login, /api/report (with the stub
+classifier backend) and the cosmetics endpoints twice: in-process through
+the Flask test client, and over HTTP against a multi-worker gunicorn
+server. Without gunicorn the server run fails unless --allow-werkzeug
+accepts a single-process threaded werkzeug server instead.
+
+Each run writes a JSON baseline with p50/p95/p99 latency, throughput and
+peak memory per endpoint. Pass --compare with an earlier baseline to fail
+on regressions; runs against a different kind of server are refused:
+
+    python tests/run_benchmarks.py --scale 10k --out bench-main.json
+    python tests/run_benchmarks.py --scale 10k --compare bench-main.json
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+SEED = 1234
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench-password"
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+SPECIES = ["Kudzu", "Japanese Knotweed", "Garlic Mustard", "Emerald Ash Borer", "Spotted Lanternfly", "English Ivy"]
+CENTERS = [(40.343094, -74.651448), (40.7128, -74.0060), (37.7749, -122.4194), (51.5074, -0.1278)]
+INSERT_CHUNK = 50_000
+
+
+def parse_scale(raw: str) -> int:
+    return SCALES.get(raw.lower()) or int(raw)
+
+
+def seed(path: Path, reports: int, users: int = 100) -> None:
+    """Create a database at path with `users` accounts and `reports` invasive reports."""
+    import auth as auth_module
+    import clusters
+    import db
+    import migrations
+
+    rng = random.Random(SEED)
+    conn = db.connect(path)
+    migrations.migrate(conn)
+    # One hash for everyone; pbkdf2 per row would dominate seeding time
+    hashed = auth_module.PWD_CONTEXT.hash(BENCH_PASSWORD)
+    with db.transaction(conn) as cur:
+        cur.executemany(
+            "INSERT INTO users (username, password, xp_total, xp_balance, level) VALUES (?, ?, ?, ?, ?)",
+            [(BENCH_USER if i == 0 else f"{BENCH_USER}{i}", hashed, 1_000_000, 1_000_000, 5) for i in range(users)],
+        )
+        # Matching ledger entries, so the seeded totals survive xp.reconcile()
+        cur.execute("INSERT INTO xp_events (user_id, amount, reason) SELECT id, 1000000, 'opening_balance' FROM users")
+    created_at = datetime(2025, 1, 1).isoformat()
+    done = 0
+    while done < reports:
+        rows = []
+        for i in range(done, min(reports, done + INSERT_CHUNK)):
+            lat, lng = rng.choice(CENTERS)
+            user = i % users + 1
+            rows.append((
+                str(user), BENCH_USER if user == 1 else f"{BENCH_USER}{user - 1}", rng.choice(SPECIES), 1,
+                "Seeded benchmark report.", lat + rng.uniform(-0.5, 0.5), lng + rng.uniform(-0.5, 0.5),
+                f"bench_{i}.jpg", created_at,
+            ))
+        with db.transaction(conn) as cur:
+            cur.executemany(
+                """
+                INSERT INTO reports (user_id, username, species, invasive, summary, lat, lng, image_filename, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+        done += len(rows)
+    with db.transaction(conn) as cur:
+        clusters.rebuild(conn)
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def fake_jpeg(rng: random.Random) -> bytes:
+    # Unique bytes per request so the classification cache never answers
+    return b"\xff\xd8\xff\xe0" + rng.randbytes(2048)
+
+
+def scenarios():
+    """(name, method, path, kwargs factory, acceptable statuses)."""
+    rng = random.Random(SEED)
+    lock = threading.Lock()
+
+    def upload():
+        with lock:
+            data = fake_jpeg(rng)
+        return {"files": {"image": ("bench.jpg", data, "image/jpeg")}, "data": {"lat": "40.34", "lng": "-74.65"}}
+
+    login = {"json": {"username": BENCH_USER, "password": BENCH_PASSWORD}}
+    return [
+        ("reports_full", "GET", "/api/reports", lambda: {}, {200}),
+        ("reports_limit_500", "GET", "/api/reports?limit=500", lambda: {}, {200}),
+        ("reports_markers", "GET", "/api/reports?fields=id,lat,lng,species", lambda: {}, {200}),
+        ("reports_page_2", "GET", "/api/reports?before_id=5000&limit=500", lambda: {}, {200}),
+        ("reports_bbox", "GET", "/api/reports?bbox=40.2,-74.8,40.5,-74.5&limit=500", lambda: {}, {200}),
+        ("profile", "GET", "/api/profile", lambda: {}, {200}),
+        ("login", "POST", "/api/login", lambda: login, {200}),
+        ("report_stub", "POST", "/api/report", upload, {200}),
+        ("cosmetics_purchase", "POST", "/api/cosmetics/purchase", lambda: {"json": {"id": "pot_white"}}, {200, 400}),
+        ("cosmetics_equip", "POST", "/api/cosmetics/equip", lambda: {"json": {"id": "pot_white"}}, {200}),
+    ]
+
+
+def summarize(latencies: list, wall: float, errors: int) -> dict:
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return round(ordered[max(0, math.ceil(p * len(ordered)) - 1)] * 1000, 3) if ordered else None
+
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+        "throughput_rps": round(len(ordered) / wall, 1) if wall else None,
+    }
+
+
+def run_inprocess(requests_per: int) -> dict:
+    """Sequential requests through the Flask test client; memory is Python heap via tracemalloc."""
+    import app as app_module
+
+    app_module.app.config["UPLOAD_FOLDER"] = os.environ["INVASISEE_UPLOAD_FOLDER"]
+    client = app_module.app.test_client()
+    client.post("/api/login", json={"username": BENCH_USER, "password": BENCH_PASSWORD})
+    results = {}
+    for name, method, path, kwargs, ok in scenarios():
+        latencies, errors = [], 0
+        tracemalloc.start()
+        started = time.perf_counter()
+        for _ in range(requests_per):
+            kw = kwargs()
+            if "files" in kw:
+                # The test client takes uploads as (stream, filename) form fields
+                fname, data, _ = kw["files"]["image"]
+                kw = {"data": dict(kw["data"], image=(io.BytesIO(data), fname))}
+            t0 = time.perf_counter()
+            resp = client.open(path, method=method, **kw)
+            latencies.append(time.perf_counter() - t0)
+            errors += resp.status_code not in ok
+        wall = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = summarize(latencies, wall, errors)
+        results[name]["peak_heap_kib"] = peak // 1024
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, workers: int, threads: int, env: dict, allow_werkzeug: bool = False):
+    try:
+        import gunicorn  # noqa: F401
+        cmd = [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads),
+               "-b", f"127.0.0.1:{port}", "--log-level", "warning", "app:app"]
+        kind = f"gunicorn w={workers} threads={threads}"
+    except ImportError:
+        if not allow_werkzeug:
+            raise RuntimeError("gunicorn is not installed (see requirements.txt); "
+                               "pass --allow-werkzeug to benchmark a single-process server instead")
+        cmd = [sys.executable, __file__, "--serve", str(port)]
+        kind = "werkzeug threaded"
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    return proc, kind
+
+
+def _process_tree(pid: int) -> list:
+    """pid and its live descendants (e.g. gunicorn workers), from /proc."""
+    children = {}
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # The command name may contain spaces; fields after it are fixed
+            ppid = int(stat.read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(stat.parent.name))
+    tree = [pid]
+    for p in tree:
+        tree.extend(children.get(p, []))
+    return tree
+
+
+def server_peak_rss(pid: int) -> dict:
+    """Peak resident set (VmHWM) of the server's own processes; empty where /proc is unavailable."""
+    peaks = []
+    for p in _process_tree(pid):
+        try:
+            for line in Path(f"/proc/{p}/status").read_text().splitlines():
+                if line.startswith("VmHWM:"):
+                    peaks.append(int(line.split()[1]))
+        except OSError:
+            continue
+    if not peaks:
+        return {}
+    return {"peak_rss_kib": max(peaks), "total_peak_rss_kib": sum(peaks), "processes": len(peaks)}
+
+
+def wait_for_server(url: str, timeout: float = 30.0) -> bool:
+    import requests
+
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            if requests.get(url, timeout=0.5).status_code < 500:
+                return True
+        except Exception:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def run_server(requests_per: int, concurrency: int, base: str) -> dict:
+    """Concurrent requests over HTTP, one logged-in keep-alive session per client thread."""
+    import requests
+
+    local = threading.local()
+
+    def session():
+        s = getattr(local, "session", None)
+        if s is None:
+            s = local.session = requests.Session()
+            s.post(base + "/api/login", json={"username": BENCH_USER, "password": BENCH_PASSWORD})
+        return s
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for name, method, path, kwargs, ok in scenarios():
+            def one(_):
+                s = session()
+                kw = kwargs()
+                t0 = time.perf_counter()
+                try:
+                    status = s.request(method, base + path, timeout=60, **kw).status_code
+                except requests.RequestException:
+                    status = None
+                return time.perf_counter() - t0, status in ok
+
+            started = time.perf_counter()
+            # one() logs each thread in before its timer starts
+            samples = list(pool.map(one, range(requests_per)))
+            wall = time.perf_counter() - started
+            results[name] = summarize([lat for lat, _ in samples], wall, sum(not good for _, good in samples))
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Regressions: p95 up or throughput down by more than threshold (a fraction)."""
+    problems = []
+    for scale, modes in current["runs"].items():
+        kind = modes.get("server_info", {}).get("kind")
+        before_kind = baseline.get("runs", {}).get(scale, {}).get("server_info", {}).get("kind")
+        if kind and before_kind and kind != before_kind:
+            problems.append(f"{scale}/server: not comparable, ran on {kind!r} but the baseline on {before_kind!r}")
+            modes = {mode: endpoints for mode, endpoints in modes.items() if mode != "server"}
+        for mode, endpoints in modes.items():
+            if not isinstance(endpoints, dict) or mode == "server_info":
+                continue
+            for name, now in endpoints.items():
+                before = baseline.get("runs", {}).get(scale, {}).get(mode, {}).get(name)
+                if not before or not isinstance(now, dict):
+                    continue
+                if before.get("p95_ms") and now["p95_ms"] > before["p95_ms"] * (1 + threshold):
+                    problems.append(f"{scale}/{mode}/{name}: p95 {before['p95_ms']} -> {now['p95_ms']} ms")
+                if before.get("throughput_rps") and now["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+                    problems.append(
+                        f"{scale}/{mode}/{name}: throughput {before['throughput_rps']} -> {now['throughput_rps']} rps"
+                    )
+    return problems
+
+
+def bench_scale(label: str, reports: int, args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix=f"invasisee-bench-{label}-"))
+    db_file = workdir / "bench.db"
+    env = dict(os.environ, INVASISEE_DB_PATH=str(db_file), INVASISEE_UPLOAD_FOLDER=str(workdir / "uploads"),
+               CLASSIFIER_BACKEND="stub", SECRET_KEY=os.getenv("SECRET_KEY", "bench-secret"),
+               # Every simulated client shares 127.0.0.1; measure logins, not the throttle
+               LOGIN_MAX_PER_IP=os.getenv("LOGIN_MAX_PER_IP", "1000000"))
+    os.environ.update(env)
+    try:
+        t0 = time.perf_counter()
+        seed(db_file, reports)
+        seconds = round(time.perf_counter() - t0, 2)
+        print(f"[{label}] seeded {reports} reports in {seconds}s")
+        run = {"seed_seconds": seconds}
+        if args.mode in ("inprocess", "both"):
+            run["inprocess"] = run_inprocess(args.requests)
+            print_table(label, "inprocess", run["inprocess"])
+        if args.mode in ("server", "both"):
+            port = _free_port()
+            proc, kind = start_server(port, args.workers, args.threads, env, args.allow_werkzeug)
+            memory = {}
+            try:
+                if not wait_for_server(f"http://127.0.0.1:{port}/api/reports?limit=1"):
+                    raise RuntimeError("server did not start")
+                run["server"] = run_server(args.requests, args.concurrency, f"http://127.0.0.1:{port}")
+                # Read while the processes are alive; RUSAGE_CHILDREN would mix in every earlier child
+                memory = server_peak_rss(proc.pid)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+            run["server_info"] = {"kind": kind, **memory}
+            print_table(label, "server", run["server"])
+        return run
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_table(label: str, mode: str, results: dict) -> None:
+    print(f"\n[{label}] {mode}")
+    print(f"  {'endpoint':<22}{'p50':>9}{'p95':>9}{'p99':>9}{'rps':>10}{'err':>6}")
+    for name, r in results.items():
+        print(f"  {name:<22}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['throughput_rps']:>10}{r['errors']:>6}")
+
+
+def reset_connections() -> None:
+    """Close pooled connections so the next scale's scratch database is picked up."""
+    import db
+    while not db._pool.empty():
+        db._pool.get_nowait().close()
+    conn = getattr(db._local, "conn", None)
+    if conn is not None:
+        conn.close()
+        db._local.conn = None
+
+
+def serve(port: int) -> None:
+    from werkzeug.serving import run_simple
+    import app as app_module
+    run_simple("127.0.0.1", port, app_module.app, threaded=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the hot API endpoints.")
+    parser.add_argument("--scale", action="append", help="Seeded reports: 10k, 100k, 1m or a number (repeatable)")
+    parser.add_argument("--mode", choices=("inprocess", "server", "both"), default="both")
+    parser.add_argument("--requests", "-n", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--concurrency", "-c", type=int, default=16, help="Client threads in server mode")
+    parser.add_argument("--workers", "-w", type=int, default=4, help="Server worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="Threads per server worker")
+    parser.add_argument("--out", "-o", help="Write results as JSON (default: tests/benchmarks/<commit>.json)")
+    parser.add_argument("--compare", help="Baseline JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed regression as a fraction")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch databases")
+    parser.add_argument("--allow-werkzeug", action="store_true",
+                        help="Without gunicorn, benchmark a single-process werkzeug server instead of failing")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve)
+        return 0
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "requests_per_endpoint": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "threads": args.threads,
+        },
+        "runs": {},
+    }
+    for raw in args.scale or ["10k"]:
+        report["runs"][raw.lower()] = bench_scale(raw.lower(), parse_scale(raw), args)
+        reset_connections()
+    report["meta"]["peak_rss_kib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    out = Path(args.out) if args.out else ROOT / "tests" / "benchmarks" / f"{commit}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"\nWrote {out}")
+
+    if args.compare:
+        problems = compare(report, json.loads(Path(args.compare).read_text()), args.threshold)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        if problems:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Regression checks for the classification cache's near-duplicate tier.
+
+Flat images (solid colours, dark frames) all hash to ~0 and must not share
+cached results; a resized copy of a textured photo still should.
+
+    python tests/run_classification_cache.py
+"""
+import io
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("INVASISEE_DB_PATH", str(Path(tempfile.mkdtemp(prefix="invasisee-cache-")) / "cache.db"))
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from PIL import Image  # noqa: E402
+
+import classification_cache  # noqa: E402
+import migrations  # noqa: E402
+
+
+MODEL = "openai:test"
+
+
+def jpeg(img: Image.Image) -> io.BytesIO:
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=90)
+    out.seek(0)
+    return out
+
+
+def textured(size=(640, 480), seed=7) -> Image.Image:
+    rng = random.Random(seed)
+    img = Image.new("RGB", (16, 12))
+    img.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(16 * 12)])
+    return img.resize(size)
+
+
+def run() -> int:
+    migrations.migrate()
+    failures = []
+
+    flats = [(200, 30, 30), (30, 200, 30), (30, 30, 200), (10, 10, 10)]
+    keys = [classification_cache.CacheKey(jpeg(Image.new("RGB", (320, 240), color)), MODEL) for color in flats]
+    classification_cache.put(keys[0], {"species": "first"})
+    for color, key in zip(flats[1:], keys[1:]):
+        if classification_cache.get(key) is not None:
+            failures.append(f"flat image {color} reused another image's result")
+    again = classification_cache.CacheKey(jpeg(Image.new("RGB", (320, 240), flats[0])), MODEL)
+    if classification_cache.get(again) is None:
+        failures.append("identical flat image missed the exact tier")
+
+    original = textured()
+    classification_cache.put(classification_cache.CacheKey(jpeg(original), MODEL), {"species": "textured"})
+    resized = classification_cache.CacheKey(jpeg(original.resize((320, 240))), MODEL)
+    if (classification_cache.get(resized) or {}).get("species") != "textured":
+        failures.append("resized textured copy missed the near-duplicate tier")
+    if classification_cache.get(classification_cache.CacheKey(jpeg(original), "openai:other")) is not None:
+        failures.append("another model's entry was served")
+
+    for failure in failures:
+        print("FAIL:", failure)
+    print("OK" if not failures else f"{len(failures)} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,120 @@
+"""Experience points ledger.
+
+Every XP change is an append-only row in xp_events (positive amounts are
+earned, negative ones spent). The totals on users are maintained in the
+same transaction with UPDATE-with-arithmetic, so concurrent awards never
+read stale values, and can always be recomputed from the ledger with
+reconcile().
+"""
+import sqlite3
+from typing import Iterable, Optional
+
+import leaderboard
+
+XP_THRESHOLDS = [0, 50, 150, 300, 500]  # Levels 1..5
+MAX_LEVEL = 5
+XP_PER_INVASIVE = 50  # Award per correct (invasive) report
+
+REASON_REPORT = "invasive_report"
+REASON_COSMETIC = "cosmetic"
+REASON_OPENING = "opening_balance"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS xp_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    report_id INTEGER,
+    item_id TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_xp_events_user ON xp_events (user_id, amount);
+"""
+
+
+def compute_level(xp_total: int) -> int:
+    lvl = 1
+    for i, thr in enumerate(XP_THRESHOLDS, start=1):
+        if xp_total >= thr:
+            lvl = i
+    return min(lvl, MAX_LEVEL)
+
+
+def level_sql(total_expr: str) -> str:
+    """SQL CASE expression equal to compute_level(total_expr)."""
+    levels = list(enumerate(XP_THRESHOLDS, start=1))[:MAX_LEVEL]
+    whens = " ".join(f"WHEN {total_expr} >= {thr} THEN {lvl}" for lvl, thr in reversed(levels))
+    return f"CASE {whens} ELSE 1 END"
+
+
+def award(cur: sqlite3.Cursor, user_id, amount: int, reason: str, report_ids: Iterable[Optional[int]] = (None,)) -> None:
+    """Record earned XP and bump the user's totals; amount is per entry of report_ids.
+
+    Call inside the transaction that makes the award happen.
+    """
+    report_ids = list(report_ids)
+    if not user_id or not amount or not report_ids:
+        return
+    cur.executemany(
+        "INSERT INTO xp_events (user_id, amount, reason, report_id) VALUES (?, ?, ?, ?)",
+        [(int(user_id), amount, reason, rid) for rid in report_ids],
+    )
+    total = amount * len(report_ids)
+    cur.execute(
+        f"""
+        UPDATE users SET
+            xp_total = COALESCE(xp_total, 0) + :total,
+            xp_balance = COALESCE(xp_balance, 0) + :total,
+            level = {level_sql("COALESCE(xp_total, 0) + :total")}
+        WHERE id = :user_id
+        """,
+        {"total": total, "user_id": int(user_id)},
+    )
+    leaderboard.record(cur, user_id, total)
+
+
+def spend(cur: sqlite3.Cursor, user_id, cost: int, reason: str, item_id: Optional[str] = None) -> Optional[int]:
+    """Deduct cost if the balance covers it. Returns the new balance, or None if it doesn't."""
+    cur.execute(
+        "UPDATE users SET xp_balance = xp_balance - ? WHERE id = ? AND COALESCE(xp_balance, 0) >= ?",
+        (cost, int(user_id), cost),
+    )
+    if cur.rowcount != 1:
+        return None
+    cur.execute(
+        "INSERT INTO xp_events (user_id, amount, reason, item_id) VALUES (?, ?, ?, ?)",
+        (int(user_id), -cost, reason, item_id),
+    )
+    cur.execute("SELECT xp_balance FROM users WHERE id = ?", (int(user_id),))
+    return cur.fetchone()[0]
+
+
+def reconcile(cur: sqlite3.Cursor, user_id=None) -> int:
+    """Recompute totals and level from the ledger (one user, or everyone). Returns rows corrected."""
+    only = "WHERE u.id = :user_id" if user_id is not None else ""
+    # rowcount isn't reported for statements starting with WITH
+    before = cur.connection.total_changes
+    cur.execute(
+        f"""
+        WITH ledger AS (
+            SELECT u.id AS user_id,
+                   COALESCE((SELECT SUM(amount) FROM xp_events e WHERE e.user_id = u.id AND e.amount > 0), 0) AS earned,
+                   COALESCE((SELECT SUM(amount) FROM xp_events e WHERE e.user_id = u.id), 0) AS balance
+            FROM users u {only}
+        )
+        UPDATE users SET xp_total = ledger.earned, xp_balance = ledger.balance, level = {level_sql("ledger.earned")}
+        FROM ledger
+        WHERE ledger.user_id = users.id
+            AND (users.xp_total IS NOT ledger.earned OR users.xp_balance IS NOT ledger.balance
+                 OR users.level IS NOT {level_sql("ledger.earned")})
+        """,
+        {"user_id": int(user_id) if user_id is not None else None},
+    )
+    return cur.connection.total_changes - before
+
+
+if __name__ == "__main__":
+    import db
+    with db.transaction(db.connect(), immediate=True) as cur:
+        print(f"Reconciled XP for {reconcile(cur)} users")